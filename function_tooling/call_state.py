@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import os
+
+from function_tooling.tool_phases import UNVERIFIED
+
+logger = logging.getLogger(__name__)
+
+
+'''
+State that belongs to one phone call, created with the ServiceDeskFunctionContext.
+It is passed to every backend function as the `call_state` kwarg, next to phone_number.
+
+The caller prefetch starts as soon as the job starts: while the greeting plays we look up the
+caller's sys_user record and recent requests from the SIP phone number, so verify_employee and the
+first ServiceNow tools can answer from memory.
+'''
+
+PREFETCH_WAIT = float(os.getenv("CALLER_PREFETCH_WAIT", "1.5"))
+
+
+class CallState:
+    def __init__(self, phone_number=None):
+        self.phone_number = phone_number
+        self._prefetch_task = None
+        # employee_number -> sys_id (or None when ServiceNow has no such employee) for this call
+        self.sys_ids = {}
+        # guide name -> last part handed to the LLM (guide_cache.next_section)
+        self.guide_progress = {}
+        # conversation phase, decides which tools the LLM is shown (tool_phases)
+        self.phase = UNVERIFIED
+
+    def __repr__(self):
+        return f"CallState(phone_number={self.phone_number!r})"
+
+    def start_prefetch(self, servicenow):
+        if not self.phone_number or servicenow is None or self._prefetch_task is not None:
+            return
+        self._prefetch_task = asyncio.create_task(servicenow.prefetch_caller(self.phone_number))
+
+    async def caller(self, timeout=PREFETCH_WAIT):
+        """
+        Prefetched {"profile": {...}, "requests": [...]} or None.
+        Waits at most `timeout` for an in-flight prefetch, callers fall back to a live lookup.
+        """
+        if self._prefetch_task is None:
+            return None
+        try:
+            # shield so a timeout here does not cancel the prefetch for later tools
+            return await asyncio.wait_for(asyncio.shield(self._prefetch_task), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.debug("Caller prefetch still running, using live lookup")
+        except Exception as e:
+            logger.error(f"Caller prefetch failed: {str(e)}")
+        return None
+
+    async def caller_profile(self, timeout=PREFETCH_WAIT):
+        caller = await self.caller(timeout)
+        return caller["profile"] if caller else None
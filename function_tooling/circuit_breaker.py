@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Per-backend circuit breakers for the tool calls that hit ServiceNow / Graph.
+
+Each call gets a timeout derived from the recent latency of that function (p95 * 1.5, clamped to
+[BREAKER_MIN_TIMEOUT, BREAKER_MAX_TIMEOUT]), so the LLM hears an error within a fixed budget instead
+of dead air. After BREAKER_FAILURE_THRESHOLD consecutive failures the breaker opens and calls fail fast;
+after BREAKER_RESET_TIMEOUT one probe call is let through (half-open) to decide whether to close again.
+
+Breakers are process wide (get_breaker), so every call in the worker sees the same backend health.
+'''
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name,
+        failure_threshold=None,
+        reset_timeout=None,
+        min_timeout=None,
+        max_timeout=None,
+        percentile=0.95,
+        multiplier=1.5,
+        window=100,
+        min_samples=10,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+        self.min_timeout = min_timeout or float(os.getenv("BREAKER_MIN_TIMEOUT", "2"))
+        self.max_timeout = max_timeout or float(os.getenv("BREAKER_MAX_TIMEOUT", "8"))
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def timeout(self, operation):
+        samples = self._latencies[operation]
+        if len(samples) < self.min_samples:
+            return self.max_timeout
+        ordered = sorted(samples)
+        observed = ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+        return min(max(observed * self.multiplier, self.min_timeout), self.max_timeout)
+
+    def _before_call(self):
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self.state = HALF_OPEN
+            logger.info(f"{self.name} circuit half-open, probing")
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"{self.name} circuit is half-open and already probing")
+            self._probe_in_flight = True
+
+    def _record_success(self, operation, latency):
+        self._latencies[operation].append(latency)
+        if self.state != CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def _record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"{self.name} circuit opened after {self._failures} failures")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    async def call(self, operation, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) under the adaptive timeout.
+        Raises CircuitOpenError when failing fast and asyncio.TimeoutError when the budget runs out.
+        Result dicts with a 5xx code count as failures but are still returned.
+        """
+        self._before_call()
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout=self.timeout(operation))
+        except asyncio.CancelledError:
+            self._probe_in_flight = False
+            raise
+        except BaseException:
+            self._record_failure()
+            raise
+
+        if isinstance(result, dict) and isinstance(result.get("code"), int) and result["code"] >= 500:
+            self._record_failure()
+        else:
+            self._record_success(operation, time.monotonic() - start)
+        return result
+
+
+_breakers = {}
+
+
+def get_breaker(name):
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+    return _breakers[name]
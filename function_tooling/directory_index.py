@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import re
+from collections import namedtuple
+
+from graph_client import GRAPH_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+
+'''
+In-process mirror of the tenant's users, kept in sync with Graph delta queries.
+The first sync runs in prewarm (bounded, it resumes from the last page if it runs out of time),
+after that a background task applies incremental deltas. Member resolution and name matching
+for the distribution list tools become dictionary lookups instead of /users/{email} calls.
+'''
+
+DirectoryUser = namedtuple("DirectoryUser", ["id", "mail", "display_name", "employee_id", "upn"])
+
+USER_SELECT = "id,mail,displayName,employeeId,userPrincipalName"
+
+
+def normalize_name(name):
+    """'John Doe', 'john.doe' and 'john_doe' all map to 'johndoe'"""
+    return re.sub(r"[^a-z0-9]", "", (name or "").lower())
+
+
+class DirectoryIndex:
+    def __init__(self, graph, refresh_interval=None):
+        self.graph = graph
+        self.refresh_interval = refresh_interval or float(os.getenv("DIRECTORY_REFRESH_INTERVAL", "300"))
+        self.loaded = False
+        self._users = {}
+        self._by_mail = {}
+        self._by_employee_id = {}
+        self._by_name = {}
+        self._next_link = None
+        self._delta_link = None
+        # user ids seen by a full resync after the delta link expired, None when not resyncing
+        self._resync_ids = None
+        self._sync_lock = None
+        self._sync_loop = None
+        self._refresh_task = None
+
+    def __len__(self):
+        return len(self._users)
+
+    async def sync(self):
+        """Full load on first run, incremental afterwards. Safe to resume after a timeout."""
+        loop = asyncio.get_running_loop()
+        if self._sync_loop is not loop:
+            self._sync_lock = asyncio.Lock()
+            self._sync_loop = loop
+        async with self._sync_lock:
+            full_url = f"{GRAPH_BASE_URL}/users/delta?$select={USER_SELECT}"
+            url = self._next_link or self._delta_link or full_url
+            changes = 0
+            while url:
+                response = await self.graph.request("GET", url)
+                if response.status_code == 410 and url != full_url:
+                    # the delta token expired (syncStateNotFound / resyncRequired), start over with a
+                    # full load and drop the users it no longer returns once it is complete
+                    logger.warning("Directory delta link expired, running a full resync")
+                    self._next_link = self._delta_link = None
+                    self._resync_ids = set()
+                    url = full_url
+                    continue
+                response.raise_for_status()
+                page = response.json()
+                for user in page.get("value", []):
+                    self._apply(user)
+                    if self._resync_ids is not None and user.get("id"):
+                        self._resync_ids.add(user["id"])
+                    changes += 1
+
+                if "@odata.nextLink" in page:
+                    url = self._next_link = page["@odata.nextLink"]
+                else:
+                    url = self._next_link = None
+                    self._delta_link = page.get("@odata.deltaLink")
+                    self._finish_resync()
+
+            if not self.loaded:
+                logger.info(f"Directory index loaded with {len(self._users)} users")
+            elif changes:
+                logger.debug(f"Directory index applied {changes} changes")
+            self.loaded = True
+
+    def _finish_resync(self):
+        if self._resync_ids is None:
+            return
+        gone = [user_id for user_id in self._users if user_id not in self._resync_ids]
+        for user_id in gone:
+            self._unindex(self._users.pop(user_id))
+        self._resync_ids = None
+        logger.info(f"Directory resync complete, {len(gone)} users removed")
+
+    def _apply(self, user):
+        user_id = user.get("id")
+        if not user_id:
+            return
+        previous = self._users.get(user_id)
+        if previous:
+            self._unindex(previous)
+        if "@removed" in user:
+            self._users.pop(user_id, None)
+            return
+
+        # delta pages for existing users may only carry the changed properties
+        record = DirectoryUser(
+            id=user_id,
+            mail=user.get("mail", previous.mail if previous else None),
+            display_name=user.get("displayName", previous.display_name if previous else None),
+            employee_id=user.get("employeeId", previous.employee_id if previous else None),
+            upn=user.get("userPrincipalName", previous.upn if previous else None),
+        )
+        self._users[user_id] = record
+        self._index(record)
+
+    def _index(self, record):
+        for address in (record.mail, record.upn):
+            if address:
+                self._by_mail[address.lower()] = record.id
+                self._by_name.setdefault(normalize_name(address.split("@")[0]), set()).add(record.id)
+        if record.employee_id:
+            self._by_employee_id[str(record.employee_id)] = record.id
+        if record.display_name:
+            self._by_name.setdefault(normalize_name(record.display_name), set()).add(record.id)
+
+    def _unindex(self, record):
+        for address in (record.mail, record.upn):
+            if address:
+                self._by_mail.pop(address.lower(), None)
+                self._discard_name(normalize_name(address.split("@")[0]), record.id)
+        if record.employee_id:
+            self._by_employee_id.pop(str(record.employee_id), None)
+        if record.display_name:
+            self._discard_name(normalize_name(record.display_name), record.id)
+
+    def _discard_name(self, key, user_id):
+        ids = self._by_name.get(key)
+        if ids:
+            ids.discard(user_id)
+            if not ids:
+                del self._by_name[key]
+
+    def get_by_email(self, email):
+        user_id = self._by_mail.get((email or "").lower())
+        return self._users.get(user_id) if user_id else None
+
+    def get_by_employee_id(self, employee_id):
+        user_id = self._by_employee_id.get(str(employee_id))
+        return self._users.get(user_id) if user_id else None
+
+    def find_by_name(self, name):
+        """Users whose display name or mailbox name matches, empty when unknown"""
+        return [self._users[user_id] for user_id in self._by_name.get(normalize_name(name), ())]
+
+    def ensure_refreshing(self):
+        loop = asyncio.get_running_loop()
+        if (
+            self._refresh_task is not None
+            and not self._refresh_task.done()
+            and self._refresh_task.get_loop() is loop
+        ):
+            return
+        self._refresh_task = loop.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            # an unfinished prewarm load resumes straight away
+            if self.loaded:
+                await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Directory delta sync failed: {str(e)}")
+                await asyncio.sleep(30)
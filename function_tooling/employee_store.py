@@ -0,0 +1,157 @@
+from abc import ABCMeta, abstractmethod
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Employee verification stores, used by ServiceNow.verify_employee.
+Every store answers get(employee_id) -> {"employee_id", "name", "username", ...} or None in O(1).
+
+MmapEmployeeStore reads a snapshot file built with write_snapshot() (see the __main__ block below).
+The file is an open-addressing hash table that is memory-mapped read only, so lookups do not parse
+anything up front and every worker process on the host shares the same pages from the OS page cache.
+
+Snapshot layout (little endian):
+    header  : magic (8s) | slot_count (I) | record_count (I)
+    slots   : slot_count * (crc32 of employee_id (I) | record offset + 1, 0 = empty (I))
+    records : length (H) | utf-8 JSON
+'''
+
+MAGIC = b"EMPSNAP1"
+HEADER = struct.Struct("<8sII")
+SLOT = struct.Struct("<II")
+RECORD_LEN = struct.Struct("<H")
+
+# demo record used when no snapshot is configured, verification is hard coded to 9080 (see README)
+DEMO_EMPLOYEES = [
+    {
+        "employee_id": "9080",
+        "name": "Mridul Rao",
+        "username": "mridul.rao",
+    }
+]
+
+
+def _key_hash(employee_id):
+    return zlib.crc32(str(employee_id).encode("utf-8"))
+
+
+class EmployeeStore(metaclass=ABCMeta):
+    @abstractmethod
+    def get(self, employee_id):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+
+class DictEmployeeStore(EmployeeStore):
+    def __init__(self, employees):
+        self._employees = {str(employee["employee_id"]): employee for employee in employees}
+
+    def get(self, employee_id):
+        return self._employees.get(str(employee_id))
+
+    def __len__(self):
+        return len(self._employees)
+
+
+class MmapEmployeeStore(EmployeeStore):
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._slot_count, self._record_count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an employee snapshot")
+        self._records_start = HEADER.size + self._slot_count * SLOT.size
+
+    def get(self, employee_id):
+        employee_id = str(employee_id)
+        key_hash = _key_hash(employee_id)
+        mask = self._slot_count - 1
+        slot = key_hash & mask
+        for _ in range(self._slot_count):
+            slot_hash, offset = SLOT.unpack_from(self._mm, HEADER.size + slot * SLOT.size)
+            if offset == 0:
+                return None
+            if slot_hash == key_hash:
+                record = self._read_record(offset - 1)
+                if record.get("employee_id") == employee_id:
+                    return record
+            slot = (slot + 1) & mask
+        return None
+
+    def _read_record(self, offset):
+        start = self._records_start + offset
+        (length,) = RECORD_LEN.unpack_from(self._mm, start)
+        return json.loads(self._mm[start + RECORD_LEN.size:start + RECORD_LEN.size + length])
+
+    def __len__(self):
+        return self._record_count
+
+    def close(self):
+        self._mm.close()
+
+
+def write_snapshot(path, employees):
+    """Build a snapshot file from an iterable of employee dicts (each needs an employee_id)"""
+    records = bytearray()
+    entries = []
+    for employee in employees:
+        employee = {**employee, "employee_id": str(employee["employee_id"])}
+        payload = json.dumps(employee, separators=(",", ":")).encode("utf-8")
+        entries.append((_key_hash(employee["employee_id"]), len(records)))
+        records += RECORD_LEN.pack(len(payload)) + payload
+
+    # power of two with load factor <= 0.5 keeps probe chains short
+    slot_count = 1
+    while slot_count < max(2 * len(entries), 8):
+        slot_count *= 2
+    slots = [(0, 0)] * slot_count
+    for key_hash, offset in entries:
+        slot = key_hash & (slot_count - 1)
+        while slots[slot][1] != 0:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = (key_hash, offset + 1)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, slot_count, len(entries)))
+        for slot in slots:
+            f.write(SLOT.pack(*slot))
+        f.write(records)
+    # atomic swap, processes that already mapped the old file keep reading it
+    os.replace(tmp_path, path)
+
+
+def load_employee_store(path=None):
+    """Called from prewarm: the snapshot from EMPLOYEE_SNAPSHOT_PATH if present, else the demo records"""
+    path = path or os.getenv("EMPLOYEE_SNAPSHOT_PATH")
+    if path and os.path.exists(path):
+        store = MmapEmployeeStore(path)
+        logger.info(f"Loaded employee snapshot {path} with {len(store)} employees")
+        return store
+    if path:
+        logger.warning(f"Employee snapshot {path} not found, using demo employees")
+    return DictEmployeeStore(DEMO_EMPLOYEES)
+
+
+if __name__ == "__main__":
+    # python employee_store.py employees.json employees.snap
+    # employees.json is a JSON list of {"employee_id", "name", "username", ...}
+    if len(sys.argv) != 3:
+        print("Usage: python employee_store.py <employees.json> <snapshot path>")
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        employees = json.load(f)
+    write_snapshot(sys.argv[2], employees)
+    print(f"Wrote {len(employees)} employees to {sys.argv[2]}")
@@ -1,3 +1,9 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent))
+
+from guide_cache import render_guides
+
 functions = [
                 {
                     "name": "get_slow_computer_troubleshooting",
@@ -79,6 +85,25 @@ functions = [
                     "name": "get_sap_gui_installation",
                     "description": "Get troubleshooting steps for SAP GUI installation",
                 },
+                {
+                    "name": "next_troubleshooting_step",
+                    "description": "Get the next part of the troubleshooting guide that is being worked through. Troubleshooting functions return a guide one part at a time; call this once the caller has gone through the current part and the issue is not resolved yet.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "guide": {
+                                "type": "string",
+                                "description": "Name of the troubleshooting function that returned the guide",
+                                "enum": [],   # filled below from the rendered guides
+                            },
+                            "section": {
+                                "type": "integer",
+                                "description": "Only to repeat or jump to a specific part, the part number from the guide's outline",
+                            },
+                        },
+                        "required": ["guide"],
+                    },
+                },
 
                 ### ServiceNow function
                 {
@@ -316,3 +341,11 @@ functions = [
                 }
             ]
 
+
+# next_troubleshooting_step accepts every guide the LLM can open
+_guide_names = render_guides().keys()
+for _fn_def in functions:
+    if _fn_def["name"] == "next_troubleshooting_step":
+        _fn_def["parameters"]["properties"]["guide"]["enum"] = [
+            fn_def["name"] for fn_def in functions if fn_def["name"] in _guide_names
+        ]
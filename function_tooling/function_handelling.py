@@ -28,9 +28,14 @@ from troubleshooting_functions import (
     get_veeva_crm_ipad_installation,
 )
 
+import asyncio
 import logging
+import os
 logger = logging.getLogger(__name__)
 
+from circuit_breaker import get_breaker, CircuitOpenError
+from guide_cache import render_guides, next_section
+
 # from servicenow_functions import (
 #     create_ticket,
 #     create_request,
@@ -121,6 +126,8 @@ class FunctionMapper:
     def __init__(self, servicenow=None, ms365group=None):
         self.servicenow = servicenow
         self.ms365group = ms365group
+        # troubleshooting guides rendered once, see guide_cache
+        self.guides = render_guides()
         self._init_function_map()
 
     def _init_function_map(self):
@@ -149,6 +156,7 @@ class FunctionMapper:
             'get_bitlocker_recovery_key_access': get_bitlocker_recovery_key_access,
             'get_bsod_troubleshooting': get_bsod_troubleshooting,
             'get_veeva_crm_ipad_installation': get_veeva_crm_ipad_installation,
+            'next_troubleshooting_step': self.next_troubleshooting_step,
 
             'create_ticket': self.servicenow.create_ticket if self.servicenow else None,
             'create_service_request': self.servicenow.create_request if self.servicenow else None,
@@ -157,12 +165,47 @@ class FunctionMapper:
             'verify_employee': self.servicenow.verify_employee if self.servicenow else None,
             
             'create_distribution_list': self.ms365group.create_empty_group if self.ms365group else None,
-            'add_user_to_distribution_list': self.ms365group.add_users_to_group if self.ms365group else None,
+            'add_users_to_distribution_list': self.ms365group.add_users_to_group if self.ms365group else None,
             'send_email_to_group': self.ms365group.send_email_to_group if self.ms365group else None,
             'schedule_meeting': self.ms365group.schedule_meeting if self.ms365group else None,
             'remove_users_from_distribution_list': self.ms365group.remove_users_from_group if self.ms365group else None
         }
 
+        # functions that call a remote backend run behind that backend's circuit breaker
+        # (verify_employee answers from the local employee store, so it is not gated)
+        self.function_backend = {
+            'create_ticket': 'servicenow',
+            'create_service_request': 'servicenow',
+            'get_service_request': 'servicenow',
+            'update_service_request': 'servicenow',
+            'create_distribution_list': 'ms365',
+            'add_users_to_distribution_list': 'ms365',
+            'send_email_to_group': 'ms365',
+            'schedule_meeting': 'ms365',
+            'remove_users_from_distribution_list': 'ms365',
+        }
+
+        # when the LLM asks for several tools in one turn they run concurrently (tool_dispatcher),
+        # except that a tool waits for the ones listed here if they are part of the same turn
+        self.function_dependencies = {
+            'create_ticket': ('verify_employee',),
+            'create_service_request': ('verify_employee',),
+            'update_service_request': ('verify_employee', 'create_service_request', 'get_service_request'),
+            'add_users_to_distribution_list': ('create_distribution_list',),
+            'remove_users_from_distribution_list': ('create_distribution_list', 'add_users_to_distribution_list'),
+            'send_email_to_group': ('create_distribution_list', 'add_users_to_distribution_list', 'remove_users_from_distribution_list'),
+            'schedule_meeting': ('create_distribution_list', 'add_users_to_distribution_list', 'remove_users_from_distribution_list'),
+        }
+
+        # max tools of one call running against a backend at the same time
+        self.backend_concurrency = {
+            'servicenow': int(os.getenv("SERVICENOW_MAX_PARALLEL_CALLS", "4")),
+            'ms365': int(os.getenv("MS365_MAX_PARALLEL_CALLS", "4")),
+        }
+
+    async def next_troubleshooting_step(self, guide, section=None, call_state=None, **kwargs):
+        return next_section(self.guides, call_state, guide, section)
+
     async def handle_function(self, name, kwargs):
         logger.debug(f"Handling function: {name} with args: {kwargs}")
         function = self.function_map.get(name)
@@ -171,25 +214,21 @@ class FunctionMapper:
             logger.error(f"Function '{name}' not found or service not initialized")
             return f"Error: Function '{name}' not found or service not initialized"
         
+        backend = self.function_backend.get(name)
         try:
+            if backend:
+                return await get_breaker(backend).call(name, function, **(kwargs or {}))
             if kwargs:
                 result = await function(**kwargs)
             else:
                 result = await function()
             return result
+        except CircuitOpenError:
+            logger.warning(f"Skipping '{name}', {backend} circuit is open")
+            return f"Error: {backend} is currently unavailable, function '{name}' was not executed. Please try again later."
+        except asyncio.TimeoutError:
+            logger.error(f"Function '{name}' timed out")
+            return f"Error: {backend} did not respond in time, function '{name}' may not have completed."
         except Exception as e:
             logger.error(f"Error executing function '{name}': {str(e)}")
             return f"Error executing function '{name}': {str(e)}"
-        
-# Update the function_handler to use FunctionMapper
-_function_mapper = None
-
-def init_function_handler(servicenow=None, ms365group=None):
-    global _function_mapper
-    _function_mapper = FunctionMapper(servicenow, ms365group)
-
-async def function_handler(name, kwargs):
-    if _function_mapper is None:
-        logger.error("Function handler not initialized")
-        return "Error: Function handler not initialized"
-    return await _function_mapper.handle_function(name, kwargs)
\ No newline at end of file
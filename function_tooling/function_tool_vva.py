@@ -1,96 +1,175 @@
-from livekit.agents.llm import FunctionContext, FunctionInfo, FunctionArgInfo
-import inspect
+from livekit.agents.llm import ChatMessage, FunctionContext
 from typing import Any
+import asyncio
 import json
+import logging
+import os
+import time
 
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))  
-from function_tooling.function_handelling import function_handler
+from function_tooling.call_state import CallState
+from function_tooling.tool_registry import ToolRegistry, current_dispatch
+from function_tooling.tool_dispatcher import ToolDispatcher
+from function_tooling.guide_cache import guide_opening, open_guide
+from function_tooling import tool_phases
 
 
 '''
 Called by Agent(TTS/S2S) to pass the JSON definition function
 We also pass the user phone-number during initialization 
+The JSON definitions are compiled once per process into a ToolRegistry (see prewarm)
 '''
 
+logger = logging.getLogger(__name__)
+
+# a tool still running after this many seconds triggers on_slow_tool (filler audio in the TTS agent)
+SLOW_TOOL_THRESHOLD = float(os.getenv("SLOW_TOOL_THRESHOLD", "1.0"))
+
 
 class ServiceDeskFunctionContext(FunctionContext):
-    def __init__(self, json_definitions: list[dict], phone_number: str = None, servicenow=None, ms365group=None):
+    def __init__(self, registry: ToolRegistry, phone_number: str = None, servicenow=None):
         super().__init__()
-        self._fncs.clear()
         self._phone_number = phone_number
-        
-        from function_tooling.function_handelling import init_function_handler
-        init_function_handler(servicenow, ms365group)
-
-        self._load_from_json(json_definitions)
-        
-
-    def _load_from_json(self, json_definitions: list[dict]):
-        for fn_def in json_definitions:
-            name = fn_def["name"]
-            description = fn_def.get("description", "")
-
-            # Add auto_retry with a default value of False if not specified
-            auto_retry = fn_def.get("auto_retry", False)
-            
-            # Handle parameters if they exist
-            args_info = {}
-            if "parameters" in fn_def:
-                properties = fn_def["parameters"].get("properties", {})
-                required = fn_def["parameters"].get("required", [])
-                
-                for arg_name, arg_def in properties.items():
-                    python_type = self._json_type_to_python(arg_def["type"])
-                    default = inspect.Parameter.empty if arg_name in required else None
-                    
-                    args_info[arg_name] = FunctionArgInfo(
-                        name=arg_name,
-                        description=arg_def.get("description", ""),
-                        type=python_type,
-                        default=default,
-                        choices=tuple(arg_def.get("enum", [])) if "enum" in arg_def else None
-                    )
-
-            # Create a closure to capture the correct name
-            def create_callable(func_name: str):
-                async def dynamic_callable(**kwargs):
-                    return await self._call_external_function(func_name, kwargs)
-                return dynamic_callable
-
-            fn_info = FunctionInfo(
-                name=name,
-                description=description,
-                auto_retry=auto_retry,  
-                callable=create_callable(name),
-                arguments=args_info
-            )
-
-            self._fncs[name] = fn_info
-
-
-    def _json_type_to_python(self, t: str) -> type:
-        type_mapping = {
-            "string": str,
-            "integer": int,
-            "number": float,
-            "boolean": bool,
-            "array": list,
-            "object": dict
-        }
-        return type_mapping.get(t, str)
+        self._servicenow = servicenow
+        self.call_state = CallState(phone_number)
+        self._mapper = registry.mapper
+        self._guides = registry.guides
+        self._router = registry.router
+        self.dispatcher = ToolDispatcher(self._mapper, self._invoke)
+
+        # the FunctionInfos are built once per process, their callables find this call's executor
+        # through current_dispatch (create the context in the job's entrypoint, before the agent)
+        current_dispatch.set(self._call_external_function)
+        self._fncs = registry.functions
+        # the tools shown to the LLM in each conversation phase, see tool_phases
+        self._phase_fncs = registry.phase_functions
+        # optional callback(phase), e.g. to push the new tool list to a realtime session
+        self.on_phase_change = None
+        # optional callback(tool name) when a tool runs longer than SLOW_TOOL_THRESHOLD
+        self.on_slow_tool = None
+        # optional callback(tool name, started_at, finished_at), wall clock seconds, for latency tracking
+        self.on_tool_timing = None
+        # (agent, guide name, system message text) routed by before_llm_cb, until its reply is spoken
+        self._routed_guide = None
+
+    @property
+    def ai_functions(self):
+        if not tool_phases.ENABLED:
+            return self._fncs
+        return self._phase_fncs[self.call_state.phase]
+
+    def _advance_phase(self, name, result=None):
+        phase = tool_phases.next_phase(self.call_state.phase, name, result)
+        if phase == self.call_state.phase:
+            return
+        logger.info(f"Call phase {self.call_state.phase} -> {phase} after {name}")
+        self.call_state.phase = phase
+        if tool_phases.ENABLED and self.on_phase_change is not None:
+            self.on_phase_change(phase)
+
+    def start_prefetch(self):
+        """Start looking up the caller in ServiceNow, call this as soon as the job starts"""
+        if self._servicenow:
+            self._servicenow.on_call_started()
+        self.call_state.start_prefetch(self._servicenow)
+
+    def on_function_calls_collected(self, fnc_calls):
+        """VoicePipelineAgent "function_calls_collected" handler, starts the turn's calls concurrently"""
+        self.dispatcher.schedule_turn([
+            (call.function_info.name, call.arguments)
+            for call in fnc_calls
+            if call.function_info.name not in self._guides
+        ])
+
+    def before_llm_cb(self, agent, chat_ctx):
+        """
+        VoicePipelineAgent before_llm_cb: when the caller's last words clearly match a troubleshooting guide
+        (intent_router), its first part is put into this request's chat_ctx (a copy) so the LLM answers
+        with it instead of spending a generation on choosing the guide tool.
+        The call's history, guide_progress and the phase only record it once that reply has been spoken,
+        see on_agent_speech_committed.
+        Returns None, the agent then runs its default LLM call on chat_ctx.
+        """
+        # a reply that was routed but never spoken (the caller talked over it) delivered nothing
+        self._routed_guide = None
+        if not chat_ctx.messages:
+            return None
+        message = chat_ctx.messages[-1]
+        if message.role != "user" or not isinstance(message.content, str):
+            return None
+
+        if self.call_state.phase == tool_phases.UNVERIFIED:
+            return None
+        name = self._router.route(message.content)
+        if name is None or name in self.call_state.guide_progress:
+            return None
+        logger.info(f"Intent router matched {name}")
+        text = (f"The caller's issue most likely matches the troubleshooting guide {name}, its first part is "
+                f"below. If it fits, walk the caller through it without calling {name}. If it does not fit "
+                f"the caller's issue, pick the right troubleshooting tool instead:\n\n"
+                f"{guide_opening(self._guides[name])}")
+        chat_ctx.append(role="system", text=text)
+        self._routed_guide = (agent, name, text)
+        return None
+
+    def on_agent_speech_committed(self, msg):
+        """
+        VoicePipelineAgent "agent_speech_committed" handler: the reply to a routed guide was spoken, keep the
+        guide in the call's history (after the caller's message, before the reply) and record it as delivered
+        """
+        if self._routed_guide is None:
+            return
+        (agent, name, text), self._routed_guide = self._routed_guide, None
+        messages = agent.chat_ctx.messages
+        index = next((i for i in range(len(messages) - 1, -1, -1) if messages[i] is msg), len(messages))
+        messages.insert(index, ChatMessage.create(role="system", text=text))
+        open_guide(self._guides[name], self.call_state)
+        self._advance_phase(name)
+
+    def on_agent_speech_interrupted(self, msg):
+        """VoicePipelineAgent "agent_speech_interrupted" handler, a routed guide was not delivered"""
+        self._routed_guide = None
 
     async def _call_external_function(self, name: str, kwargs: dict) -> str:
         """Execute the function and format the response appropriately."""
-        kwargs['phone_number'] = self._phone_number
+        guide = self._guides.get(name)
+        if guide is not None:
+            # rendered once in prewarm, see guide_cache
+            self._advance_phase(name)
+            return open_guide(guide, self.call_state)
+
+        timer = None
+        if self.on_slow_tool is not None:
+            timer = asyncio.get_running_loop().call_later(SLOW_TOOL_THRESHOLD, self._slow_tool, name)
+        started_at = time.time()
+        try:
+            return await self.dispatcher.run(name, kwargs)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if self.on_tool_timing is not None:
+                self.on_tool_timing(name, started_at, time.time())
+
+    def _slow_tool(self, name):
+        logger.info(f"{name} still running after {SLOW_TOOL_THRESHOLD}s")
+        try:
+            self.on_slow_tool(name)
+        except Exception as e:
+            logger.error(f"on_slow_tool failed: {str(e)}")
+
+    async def _invoke(self, name: str, kwargs: dict) -> str:
+        # fresh dict per invocation, parallel tool calls never share arguments
+        kwargs = {**kwargs, 'phone_number': self._phone_number, 'call_state': self.call_state}
         result = await self._execute_function(name, kwargs)
         return self._format_response(name, result)
     
 
     async def _execute_function(self, name: str, kwargs: dict) -> Any:        
         print(f"Executing {name} with arguments: {kwargs}")
-        responce = await function_handler(name, kwargs)
+        responce = await self._mapper.handle_function(name, kwargs)
+        self._advance_phase(name, responce)
 
         return str(responce)
 
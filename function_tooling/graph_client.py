@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (httpx only negotiates HTTP/2 when h2 is installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+GRAPH_BATCH_LIMIT = 20  # Graph rejects $batch payloads with more than 20 requests
+
+
+'''
+Async transport for Microsoft Graph, one per worker process (MS365Group is created once in prewarm).
+All Graph calls go through a single pooled httpx client, multiplexed over HTTP/2 when h2 is available.
+The client is created lazily on the running loop and recreated if a job runs on a different loop.
+'''
+
+
+class GraphClient:
+    def __init__(self, token_manager, max_connections=None, keepalive_expiry=None, timeout=None):
+        self.token_manager = token_manager
+        self.limits = httpx.Limits(
+            max_connections=max_connections or int(os.getenv("GRAPH_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=max_connections or int(os.getenv("GRAPH_MAX_CONNECTIONS", "20")),
+            keepalive_expiry=keepalive_expiry or float(os.getenv("GRAPH_KEEPALIVE", "60")),
+        )
+        self.timeout = httpx.Timeout(
+            timeout or float(os.getenv("GRAPH_TIMEOUT", "8")),
+            connect=float(os.getenv("GRAPH_CONNECT_TIMEOUT", "3")),
+        )
+        self._client = None
+        self._loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+            self._loop = loop
+            logger.debug(f"Created Graph client (http2={HTTP2_AVAILABLE})")
+        return self._client
+
+    def _headers(self):
+        return {
+            "Authorization": self.token_manager.authorization_header(),
+            "Content-Type": "application/json",
+        }
+
+    async def request(self, method, url, data=None) -> httpx.Response:
+        """Raises httpx.HTTPError on transport failures, status handling is left to the caller."""
+        await self.token_manager.ensure_fresh()
+        return await self._get_client().request(method, url, headers=self._headers(), json=data)
+
+    async def batch(self, requests):
+        """
+        Send sub-requests through Graph JSON $batch, 20 per batch, batches in flight concurrently.
+        Each sub-request is {"id", "method", "url" (relative, e.g. "/users/x"), optional "body"}.
+        Returns {id: {"status": int, "body": dict}}; ids from a batch that failed in transport are
+        missing from the result so callers can treat them as failed.
+        """
+        chunks = [
+            requests[i:i + GRAPH_BATCH_LIMIT]
+            for i in range(0, len(requests), GRAPH_BATCH_LIMIT)
+        ]
+        results = await asyncio.gather(
+            *(self._send_batch(chunk) for chunk in chunks), return_exceptions=True
+        )
+
+        responses = {}
+        for chunk_result in results:
+            if isinstance(chunk_result, Exception):
+                logger.error(f"Graph $batch failed: {chunk_result}")
+                continue
+            responses.update(chunk_result)
+        return responses
+
+    async def _send_batch(self, chunk):
+        payload = {"requests": []}
+        for sub_request in chunk:
+            item = {
+                "id": str(sub_request["id"]),
+                "method": sub_request["method"],
+                "url": sub_request["url"],
+            }
+            if sub_request.get("body") is not None:
+                item["body"] = sub_request["body"]
+                item["headers"] = {"Content-Type": "application/json"}
+            payload["requests"].append(item)
+
+        response = await self.request("POST", f"{GRAPH_BASE_URL}/$batch", data=payload)
+        response.raise_for_status()
+        return {
+            item["id"]: {"status": item.get("status", 500), "body": item.get("body") or {}}
+            for item in response.json().get("responses", [])
+        }
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
@@ -0,0 +1,197 @@
+import functools
+import inspect
+import logging
+import os
+from collections import namedtuple
+from types import MappingProxyType
+
+import troubleshooting_functions
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.encoding_for_model("gpt-4o")
+except Exception:  # tiktoken missing or its encoding files unavailable
+    _ENCODING = None
+
+logger = logging.getLogger(__name__)
+
+
+'''
+The troubleshooting guides rendered once per process (FunctionMapper, in prewarm).
+
+Every async function in troubleshooting_functions returns a constant dict of tuples. Each one is run
+once here and turned into the plain text the LLM gets as the tool result (title, then one "- " line per
+step under each section), with its token count. Guide tool calls are then answered with cached
+strings, nothing is rebuilt or formatted per call.
+
+With TROUBLESHOOTING_GUIDE_DELIVERY=sections (default) a guide is handed out one part at a time:
+the guide tool returns the outline and the first part, next_troubleshooting_step returns the next
+one. Progress is kept per call in CallState.guide_progress, so only the parts the caller actually
+walked through end up in the chat context. "full" returns the whole guide at once.
+'''
+
+GUIDE_DELIVERY = os.getenv("TROUBLESHOOTING_GUIDE_DELIVERY", "sections").lower()
+# step lists without headings are split into parts of this many lines
+SECTION_MAX_STEPS = int(os.getenv("TROUBLESHOOTING_SECTION_MAX_STEPS", "8"))
+
+RenderedGuide = namedtuple("RenderedGuide", ["name", "title", "text", "tokens", "sections", "opening"])
+
+
+def count_tokens(text):
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    # rough estimate for English text when tiktoken is not installed
+    return max(1, len(text) // 4)
+
+
+def _run_sync(fnc):
+    # the guide functions never await, so the coroutine finishes on the first send
+    coro = fnc()
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError(f"{fnc.__name__} awaited, it cannot be precomputed")
+
+
+def _heading(key):
+    return key.replace("_", " ").capitalize()
+
+
+def _section_items(heading, items):
+    items = list(items)
+    # some sections repeat their heading as the first item ("Additional Support:")
+    if items and items[0].rstrip(":").lower() == heading.lower():
+        items = items[1:]
+    return items
+
+
+def render_guide(guide):
+    lines = []
+    if guide.get("title"):
+        lines.append(guide["title"])
+    for key, items in guide.items():
+        if key == "title":
+            continue
+        heading = _heading(key)
+        if lines:
+            lines.append("")
+        lines.append(f"{heading}:")
+        lines.extend(f"- {item}" for item in _section_items(heading, items))
+    return "\n".join(lines)
+
+
+def _is_step_heading(item, previous):
+    # "Basic Checks", "Step 1: Restart in Safe Mode": short, not a sentence, and not the
+    # continuation of a list introduced by "...:" or of another unpunctuated line
+    if len(item) > 60 or item.rstrip().endswith((".", "?", "!", ":", ")")):
+        return False
+    return previous is None or previous.rstrip().endswith((".", "?", "!", ")"))
+
+
+def split_sections(guide):
+    """[(section title, [items])], step lists are split at their headings"""
+    sections = []
+    for key, items in guide.items():
+        if key == "title":
+            continue
+        heading = _heading(key)
+        items = _section_items(heading, items)
+        if not key.endswith("_steps"):
+            sections.append((heading, items))
+            continue
+
+        parts = [(heading, [])]
+        previous = None
+        for item in items:
+            if _is_step_heading(item, previous):
+                parts.append((item, []))
+            else:
+                parts[-1][1].append(item)
+            previous = item
+        parts = [part for part in parts if part[1]]
+
+        if len(parts) == 1:
+            title, steps = parts[0]
+            parts = [
+                (title, steps[start:start + SECTION_MAX_STEPS])
+                for start in range(0, len(steps), SECTION_MAX_STEPS)
+            ]
+        sections.extend(parts)
+    return sections
+
+
+def _render_sections(name, title, sections):
+    rendered = []
+    for index, (section_title, items) in enumerate(sections):
+        lines = [f"{title} - part {index + 1} of {len(sections)}: {section_title}"]
+        lines.extend(f"- {item}" for item in items)
+        lines.append("")
+        if index + 1 < len(sections):
+            lines.append(
+                f"Next part: {sections[index + 1][0]}. Walk the caller through this part first, then call "
+                f"next_troubleshooting_step with guide=\"{name}\" if the issue is not resolved."
+            )
+        else:
+            lines.append("This is the last part of the guide. Ask the caller whether the issue is resolved.")
+        rendered.append("\n".join(lines))
+    return tuple(rendered)
+
+
+def _render_opening(title, sections, rendered_sections):
+    if len(sections) < 2:
+        return rendered_sections[0]
+    outline = ", ".join(f"{index + 1}. {section_title}" for index, (section_title, _) in enumerate(sections))
+    return f"{title}\nParts: {outline}\n\n{rendered_sections[0]}"
+
+
+@functools.cache
+def render_guides():
+    """name -> RenderedGuide for every guide in troubleshooting_functions, rendered once per process"""
+    guides = {}
+    for name, fnc in inspect.getmembers(troubleshooting_functions, inspect.iscoroutinefunction):
+        guide = _run_sync(fnc)
+        title = guide.get("title") or name.replace("_", " ").capitalize()
+        text = render_guide(guide)
+        sections = split_sections(guide)
+        rendered_sections = _render_sections(name, title, sections)
+        guides[name] = RenderedGuide(
+            name, title, text, count_tokens(text),
+            rendered_sections, _render_opening(title, sections, rendered_sections),
+        )
+
+    logger.info(
+        f"Rendered {len(guides)} troubleshooting guides, {sum(guide.tokens for guide in guides.values())} tokens"
+        f"{'' if _ENCODING is not None else ' (estimated)'}, delivered as {GUIDE_DELIVERY}"
+    )
+    return MappingProxyType(guides)
+
+
+def guide_opening(guide):
+    """What opening the guide hands the LLM, the whole guide or its outline and first part"""
+    return guide.text if GUIDE_DELIVERY == "full" else guide.opening
+
+
+def open_guide(guide, call_state):
+    """Result of a guide tool call, records the first part as delivered"""
+    if GUIDE_DELIVERY != "full":
+        call_state.guide_progress[guide.name] = 1
+    return guide_opening(guide)
+
+
+def next_section(guides, call_state, guide, section=None):
+    """
+    Result of next_troubleshooting_step: the part after the last one this call received,
+    or part `section` (1 based) when the LLM asks for a specific one
+    """
+    rendered = guides.get(guide)
+    if rendered is None:
+        return f"Error: unknown troubleshooting guide '{guide}'"
+
+    index = int(section) if section else call_state.guide_progress.get(guide, 0) + 1
+    if index > len(rendered.sections):
+        return f"All {len(rendered.sections)} parts of '{rendered.title}' have been covered. Ask the caller whether the issue is resolved."
+    index = max(index, 1)
+    call_state.guide_progress[guide] = index
+    return rendered.sections[index - 1]
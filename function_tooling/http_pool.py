@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+'''
+One keep-alive connection pool per worker process.
+ServiceInstances creates the backends once in prewarm, so every job in the process shares
+the same TCP/TLS connections. The aiohttp session is created lazily on the running loop
+(prewarm itself has no loop) and recreated if a job runs on a different loop.
+'''
+
+
+class HttpPool:
+    def __init__(
+        self,
+        limit=None,
+        limit_per_host=None,
+        keepalive_timeout=None,
+        connect_timeout=None,
+        total_timeout=None,
+    ):
+        self.limit = limit or int(os.getenv("HTTP_POOL_LIMIT", "100"))
+        self.limit_per_host = limit_per_host or int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+        self.keepalive_timeout = keepalive_timeout or float(os.getenv("HTTP_POOL_KEEPALIVE", "60"))
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout or float(os.getenv("HTTP_POOL_TOTAL_TIMEOUT", "8")),
+            sock_connect=connect_timeout or float(os.getenv("HTTP_POOL_CONNECT_TIMEOUT", "3")),
+        )
+        self._session = None
+        self._loop = None
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._loop = loop
+            logger.debug(
+                f"Created HTTP pool (limit={self.limit}, limit_per_host={self.limit_per_host})"
+            )
+        return self._session
+
+    async def aclose(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
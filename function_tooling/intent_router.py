@@ -0,0 +1,105 @@
+import math
+import os
+import re
+from collections import defaultdict
+from types import MappingProxyType
+
+
+'''
+Keyword intent router that picks a troubleshooting guide from the caller's words without an LLM hop.
+
+An inverted index (term -> {guide: weight}) is built once per process (ToolRegistry) from each guide's
+tool description, function name, title, part titles and steps, title fields weighing more than steps.
+route() scores a final STT transcript with idf weighted term matches and only answers when the best
+guide clears INTENT_ROUTER_MIN_SCORE, matches at least INTENT_ROUTER_MIN_TERMS of the caller's words
+outside its step text and beats the runner-up by INTENT_ROUTER_MARGIN, otherwise the LLM chooses as before.
+'''
+
+MIN_SCORE = float(os.getenv("INTENT_ROUTER_MIN_SCORE", "20"))
+MARGIN = float(os.getenv("INTENT_ROUTER_MARGIN", "2.0"))
+MIN_TERMS = int(os.getenv("INTENT_ROUTER_MIN_TERMS", "2"))
+
+# field -> weight of a term found in it
+FIELD_WEIGHTS = MappingProxyType({
+    "description": 3.0,
+    "name": 3.0,
+    "title": 3.0,
+    "sections": 1.5,
+    "steps": 0.5,
+})
+# a term weighing at least this much was found outside the step text
+STRONG_WEIGHT = FIELD_WEIGHTS["sections"]
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could do does doing for from get getting go had has have having
+help how i i'm im if in into is it it's its just keep keeps me my need not of on or our please so some
+steps that the their them then there this to troubleshooting trying up us use using was we were what
+when where which while why will with won't would you your
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    return [_stem(word) for word in _WORD.findall(text.lower().replace("_", " ")) if word not in STOPWORDS]
+
+
+class IntentRouter:
+    def __init__(self, guides, json_definitions):
+        """guides: guide_cache.render_guides(), json_definitions: function_def_prompts.functions"""
+        descriptions = {fn_def["name"]: fn_def.get("description", "") for fn_def in json_definitions}
+        # only guides the LLM could have picked itself
+        names = [name for name in guides if name in descriptions]
+
+        postings = defaultdict(dict)
+        for name in names:
+            guide = guides[name]
+            fields = {
+                "description": descriptions[name],
+                "name": name.replace("get_", "", 1),
+                "title": guide.title,
+                "sections": " ".join(section.split("\n", 1)[0].split(": ", 1)[-1] for section in guide.sections),
+                "steps": guide.text,
+            }
+            weights = defaultdict(float)
+            for field, text in fields.items():
+                # presence per field, a term repeated across 40 steps should not drown the title
+                for term in set(tokenize(text)):
+                    weights[term] += FIELD_WEIGHTS[field]
+            for term, weight in weights.items():
+                postings[term][name] = weight
+
+        self.idf = MappingProxyType({
+            term: math.log(1 + len(names) / len(matches)) for term, matches in postings.items()
+        })
+        self.postings = MappingProxyType({term: MappingProxyType(matches) for term, matches in postings.items()})
+
+    def scores(self, text):
+        """guide name -> (score, number of query terms matched outside the step text)"""
+        scores = defaultdict(float)
+        strong = defaultdict(int)
+        for term in set(tokenize(text)):
+            for name, weight in self.postings.get(term, {}).items():
+                scores[name] += self.idf[term] * weight
+                if weight >= STRONG_WEIGHT:
+                    strong[name] += 1
+        return {name: (score, strong[name]) for name, score in scores.items()}
+
+    def route(self, text):
+        """The guide name the transcript clearly asks for, or None"""
+        ranked = sorted(self.scores(text).items(), key=lambda item: item[1][0], reverse=True)
+        if not ranked:
+            return None
+        name, (score, strong_terms) = ranked[0]
+        if score < MIN_SCORE or strong_terms < MIN_TERMS:
+            return None
+        if len(ranked) > 1 and score < ranked[1][1][0] * MARGIN:
+            return None
+        return name
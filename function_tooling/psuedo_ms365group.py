@@ -1,9 +1,15 @@
-import requests
+import asyncio
+import httpx
 import msal
 import os
 from datetime import datetime
 import json
 
+from graph_client import GraphClient, GRAPH_BASE_URL
+from token_manager import TokenManager
+from ttl_cache import TTLCache
+from directory_index import DirectoryIndex
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -46,30 +52,41 @@ class MS365Group:
             authority=self.authority,
             client_credential=self.client_secret,
         )
-        self.access_token = self._get_access_token()
-
-    def _get_access_token(self):
-        token_result = self.client.acquire_token_silent(self.scope, account=None)
-        if not token_result:
-            token_result = self.client.acquire_token_for_client(scopes=self.scope)
-        if "access_token" in token_result:
-            return token_result["access_token"]
-        raise Exception("Failed to acquire access token")
-
-    def _make_request(self, url, method="GET", data=None):
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json",
-        }
+        self.tokens = TokenManager(self.client, self.scope)
+        self.tokens.acquire_blocking()
+        self.graph = GraphClient(self.tokens)
+        # group name -> {id, mail, displayName}, shared by every call in this worker process
+        self.group_cache = TTLCache(
+            maxsize=int(os.getenv("GROUP_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("GROUP_CACHE_TTL", "600")),
+        )
+        self.directory = DirectoryIndex(self.graph)
+
+    async def warm_up(self, timeout=None):
+        """
+        Called once from prewarm on a throwaway loop: loads the directory index (bounded, the
+        background refresh resumes an unfinished load) then drops the loop-bound connections.
+        """
+        timeout = timeout or float(os.getenv("DIRECTORY_PREWARM_TIMEOUT", "3"))
         try:
-            response = requests.request(method, url, headers=headers, json=data)
+            await asyncio.wait_for(self.directory.sync(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Directory index partially loaded ({len(self.directory)} users), resuming in background")
+        except Exception as e:
+            print(f"Directory index load failed: {str(e)}")
+        finally:
+            await self.graph.aclose()
+
+    async def _make_request(self, url, method="GET", data=None):
+        try:
+            response = await self.graph.request(method, url, data=data)
             response.raise_for_status()
             if response.status_code == 204:  # No Content
                 return SUCCESS
             if not response.text:
                 return SUCCESS
             return {**SUCCESS, "data": response.json()}
-        except requests.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             if e.response.status_code == 404:
                 return ERRORS["NOT_FOUND"]
             elif e.response.status_code == 401:
@@ -78,27 +95,77 @@ class MS365Group:
                 return {**ERRORS["BAD_REQUEST"], "details": e.response.text}
             else:
                 return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": str(e)}
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": str(e)}
         
-    def _get_group_by_name(self, group_name):
-        url = f"https://graph.microsoft.com/v1.0/groups?$filter=displayName eq '{group_name}'"
-        result = self._make_request(url)
+    async def _get_group_by_name(self, group_name):
+        cache_key = self._group_cache_key(group_name)
+        cached = self.group_cache.get(cache_key)
+        if cached:
+            return {"code": 200, "data": cached}
+
+        url = f"https://graph.microsoft.com/v1.0/groups?$filter=displayName eq '{group_name}'&$select=id,mail,displayName"
+        result = await self._make_request(url)
         if (
             result["code"] == 200
             and "data" in result
             and "value" in result["data"]
             and result["data"]["value"]
         ):
-            return {"code": 200, "data": result["data"]["value"][0]}
+            group = result["data"]["value"][0]
+            self.group_cache.set(cache_key, group)
+            return {"code": 200, "data": group}
         return ERRORS["NOT_FOUND"]
+
+    def _emails_for_names(self, user_names):
+        """Map spoken names to mailboxes via the directory, falling back to the name@futurepath.dev guess"""
+        emails = []
+        for name in user_names:
+            if "@" in name:
+                emails.append(name)
+                continue
+            matches = [user for user in self.directory.find_by_name(name) if user.mail]
+            if len(matches) == 1:
+                emails.append(matches[0].mail)
+            else:
+                emails.append(f"{name}@futurepath.dev")
+        return emails
+
+    def _group_cache_key(self, group_name):
+        return (group_name or "").strip().lower()
     
-    def _get_user_by_email(self, email):
+    async def _get_user_by_email(self, email):
+        user = self.directory.get_by_email(email)
+        if user:
+            return user.id
         url = f"https://graph.microsoft.com/v1.0/users/{email}"
-        result = self._make_request(url)
+        result = await self._make_request(url)
         if result["code"] == 200 and "data" in result:
             return result["data"]["id"]
         return None
+
+    async def _get_user_ids_by_email(self, emails):
+        """
+        Resolve users from the directory index, anything it does not know yet (e.g. created since
+        the last delta sync) goes through $batch. Returns {email: id} for the ones that exist.
+        """
+        self.directory.ensure_refreshing()
+        user_ids = {}
+        for email in emails:
+            user = self.directory.get_by_email(email)
+            if user:
+                user_ids[email] = user.id
+
+        misses = [email for email in emails if email not in user_ids]
+        responses = await self.graph.batch([
+            {"id": str(i), "method": "GET", "url": f"/users/{email}?$select=id"}
+            for i, email in enumerate(misses)
+        ])
+        for i, email in enumerate(misses):
+            response = responses.get(str(i))
+            if response and response["status"] == 200 and response["body"].get("id"):
+                user_ids[email] = response["body"]["id"]
+        return user_ids
         
     async def create_empty_group(self, **kwargs):
         group_name = kwargs.get('groupName')
@@ -114,7 +181,8 @@ class MS365Group:
             "description": description,
         }
 
-        result = self._make_request(url, method="POST", data=data)
+        result = await self._make_request(url, method="POST", data=data)
+        self.group_cache.invalidate(self._group_cache_key(group_name))
         if result["code"] == 200 and "data" in result:
             print(f"Successfully created group: {group_name}")
             return {"result": json.dumps({
@@ -133,7 +201,7 @@ class MS365Group:
         user_names = kwargs.get('userNames')
         user_emails = kwargs.get('userEmails')
 
-        group = self._get_group_by_name(group_name)
+        group = await self._get_group_by_name(group_name)
 
         if not group or "data" not in group:
             return {**ERRORS["NOT_FOUND"], "details": f"Group not found: {group_name}"}
@@ -144,14 +212,18 @@ class MS365Group:
             user_emails = [user_emails]
 
         if user_names and not user_emails:
-            user_emails = [f"{name}@futurepath.dev" for name in user_names]
+            user_emails = self._emails_for_names(user_names)
         elif not user_emails:
             return {**ERRORS["BAD_REQUEST"], "details": "No users provided"}
 
         members_url = (
             f"https://graph.microsoft.com/v1.0/groups/{group['data']['id']}/members"
         )
-        members_result = self._make_request(members_url)
+        # current members and the users being added are resolved concurrently
+        members_result, user_ids = await asyncio.gather(
+            self._make_request(members_url),
+            self._get_user_ids_by_email(user_emails),
+        )
 
         if members_result["code"] != 200:
             return {
@@ -168,27 +240,37 @@ class MS365Group:
         existing_emails = []
         failed_emails = []
 
+        to_add = []
         for user_email in user_emails:
-            user_id = self._get_user_by_email(user_email)
+            user_id = user_ids.get(user_email)
             if not user_id:
                 failed_emails.append(user_email)
-                continue
-
-            if user_id in existing_members:
+            elif user_id in existing_members:
                 existing_emails.append(user_email)
-                continue
-
-            url = f"https://graph.microsoft.com/v1.0/groups/{group['data']['id']}/members/$ref"
-            data = {
-                "@odata.id": f"https://graph.microsoft.com/v1.0/directoryObjects/{user_id}"
+            else:
+                to_add.append(user_email)
+
+        responses = await self.graph.batch([
+            {
+                "id": str(i),
+                "method": "POST",
+                "url": f"/groups/{group['data']['id']}/members/$ref",
+                "body": {"@odata.id": f"{GRAPH_BASE_URL}/directoryObjects/{user_ids[user_email]}"},
             }
-            result = self._make_request(url, method="POST", data=data)
-
-            if result["code"] == 200:
+            for i, user_email in enumerate(to_add)
+        ])
+        for i, user_email in enumerate(to_add):
+            response = responses.get(str(i))
+            if response and response["status"] in (200, 204):
                 success_emails.append(user_email)
+            elif response and response["status"] == 400 and "already exist" in json.dumps(response["body"]):
+                existing_emails.append(user_email)
             else:
                 failed_emails.append(user_email)
 
+        if to_add:
+            self.group_cache.invalidate(self._group_cache_key(group_name))
+
         return {"result": json.dumps({
             "status": "success" if len(failed_emails) == 0 else "error",
             "message": "Completed adding users to group",
@@ -202,7 +284,7 @@ class MS365Group:
         subject = kwargs.get('subject')
         content = kwargs.get('content')
 
-        group = self._get_group_by_name(group_name)
+        group = await self._get_group_by_name(group_name)
 
         if not group or "data" not in group:
             return {"code": 404, "message": f"Group not found: {group_name}"}
@@ -224,7 +306,7 @@ class MS365Group:
         }
 
         print(f"Sending email to {group_mail} with subject:")
-        result = self._make_request(url, method="POST", data=data)
+        result = await self._make_request(url, method="POST", data=data)
 
         if result["code"] == 200:
             return {"result": json.dumps({
@@ -251,7 +333,7 @@ class MS365Group:
         if isinstance(end_time, str):
             end_time = datetime.fromisoformat(end_time)
 
-        group = self._get_group_by_name(group_name)
+        group = await self._get_group_by_name(group_name)
         if not group or "data" not in group:
             return {"code": 404, "message": f"Group not found: {group_name}"}
 
@@ -282,7 +364,7 @@ class MS365Group:
         }
 
         print(f"Sending invite to {group_mail}")
-        result = self._make_request(url, method="POST", data=data)
+        result = await self._make_request(url, method="POST", data=data)
         if result["code"] == 200:
             return {"result": json.dumps({
                 "status": "success",
@@ -300,7 +382,7 @@ class MS365Group:
         user_names = kwargs.get('userNames')
         user_emails = kwargs.get('userEmails')
 
-        group = self._get_group_by_name(group_name)
+        group = await self._get_group_by_name(group_name)
         if not group or "data" not in group:
             return {"code": 404, "message": f"Group not found: {group_name}"}
 
@@ -312,27 +394,35 @@ class MS365Group:
 
         # Generate emails from usernames if needed
         if not user_emails and user_names:
-            user_emails = [f"{name}@futurepath.dev" for name in user_names]
+            user_emails = self._emails_for_names(user_names)
         elif not user_emails:
             return {"code": 400, "message": "No users specified for removal"}
 
         success_emails = []
         failed_emails = []
 
-        for email in user_emails:
-            user_id = self._get_user_by_email(email)
-            if not user_id:
-                failed_emails.append(email)
-                continue
+        user_ids = await self._get_user_ids_by_email(user_emails)
+        to_remove = [email for email in user_emails if email in user_ids]
+        failed_emails.extend(email for email in user_emails if email not in user_ids)
 
-            url = f"https://graph.microsoft.com/v1.0/groups/{group['data']['id']}/members/{user_id}/$ref"
-            result = self._make_request(url, method="DELETE")
-
-            if result["code"] == 200:
+        responses = await self.graph.batch([
+            {
+                "id": str(i),
+                "method": "DELETE",
+                "url": f"/groups/{group['data']['id']}/members/{user_ids[email]}/$ref",
+            }
+            for i, email in enumerate(to_remove)
+        ])
+        for i, email in enumerate(to_remove):
+            response = responses.get(str(i))
+            if response and response["status"] in (200, 204):
                 success_emails.append(email)
             else:
                 failed_emails.append(email)
 
+        if to_remove:
+            self.group_cache.invalidate(self._group_cache_key(group_name))
+
         # Prepare response message based on results
         message_parts = []
         if success_emails:
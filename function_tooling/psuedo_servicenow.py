@@ -1,8 +1,17 @@
 from abc import ABCMeta, abstractmethod
-import requests
-from requests.auth import HTTPBasicAuth
+import asyncio
+import aiohttp
+import yarl
 from typing import Dict, Any
 import json
+import os
+import re
+
+from http_pool import HttpPool
+from servicenow_query import TableQuery
+from ttl_cache import TTLCache, MISSING
+from employee_store import load_employee_store
+from write_behind import WriteBehindSpool, new_reference
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -17,8 +26,12 @@ ERRORS = {
     },
     "INTERNAL_SERVER_ERROR": {"code": 500, "message": "Internal server error occurred"},
     "EMPTY_DATA": {"code": 422, "message": "The provided data is empty or invalid"},
+    "CONFLICT": {"code": 409, "message": "The resource was modified by someone else"},
 }
 
+# sc_request columns kept in the request cache
+REQUEST_FIELDS = "sys_id,number,short_description,approval,description,sys_mod_count"
+
 INSTANCE_NAME = "dev209832"
 USERNAME = "mridul@futurepath.dev"
 PASSWORD = "Best@123"
@@ -91,57 +104,143 @@ class ServiceNow(ServiceNowBase):
         print(
             f"Initializing ServiceNow with username: {self.username}, instance_name: {self.instance_name} , password: {self.password}"
         )
-        self.auth = HTTPBasicAuth(self.username, self.password)
+        self.auth = aiohttp.BasicAuth(self.username, self.password)
         self.headers = {
             "Accept": "application/json",
             "Content-Type": "application/json",
         }
         self.base_url = f"https://{self.instance_name}.service-now.com/api/now/table/"
+        self.http = HttpPool()
+        # employee_number -> sys_id shared by every call in the worker, unknown numbers are cached for less time
+        self.sys_id_cache = TTLCache(
+            maxsize=int(os.getenv("SYS_ID_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("SYS_ID_CACHE_TTL", "3600")),
+        )
+        self.sys_id_negative_ttl = float(os.getenv("SYS_ID_CACHE_NEGATIVE_TTL", "60"))
+        # O(1) verification store (mmap snapshot when EMPLOYEE_SNAPSHOT_PATH is set), loaded in prewarm
+        self.employee_store = load_employee_store()
+        self.verify_fallback = os.getenv("EMPLOYEE_VERIFY_FALLBACK", "").lower() == "servicenow"
+        # request number -> sys_id + fields, so updates can go straight to a single PATCH
+        self.request_cache = TTLCache(
+            maxsize=int(os.getenv("REQUEST_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("REQUEST_CACHE_TTL", "1800")),
+        )
+        # re-read sys_mod_count before an update and refuse it if the request changed since we cached it
+        self.update_conflict_check = os.getenv("SERVICENOW_UPDATE_CONFLICT_CHECK", "").lower() in ("1", "true")
+        # optional write-behind: creates are spooled to disk and answered with a local reference
+        self.spool = None
+        if os.getenv("SERVICENOW_WRITE_BEHIND", "").lower() in ("1", "true"):
+            self.spool = WriteBehindSpool(self._submit_spooled, on_done=self._on_spooled_done)
+            self.spool.open()
 
-    def _make_request(self, method, url, data=None):
+    async def _make_request(self, method, url, data=None):
+        if method not in ("GET", "POST", "PUT", "PATCH"):
+            return ERRORS["INTERNAL_SERVER_ERROR"]
         try:
-            if method == "GET":
-                response = requests.get(url, headers=self.headers, auth=self.auth)
-            elif method == "POST":
-                response = requests.post(
-                    url, json=data, headers=self.headers, auth=self.auth
-                )
-            elif method == "PUT":
-                response = requests.put(
-                    url, json=data, headers=self.headers, auth=self.auth
-                )
-            elif method == "PATCH":
-                response = requests.patch(
-                    url, json=data, headers=self.headers, auth=self.auth
-                )
-            else:
-                return ERRORS["INTERNAL_SERVER_ERROR"]
-
-            if response.status_code in [200, 201]:
-                result = response.json().get("result")
-                if not result:
-                    return {
-                        **ERRORS["EMPTY_DATA"],
-                        "details": "No data returned by ServiceNow",
-                    }
-                return {**SUCCESS, "data": result}
-            elif response.status_code == 404:
-                return ERRORS["NOT_FOUND"]
-            elif response.status_code == 401:
-                return ERRORS["UNAUTHORIZED"]
-            else:
-                return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": response.text}
-            
-        except requests.exceptions.RequestException as error:
+            async with self.http.session().request(
+                method,
+                yarl.URL(url, encoded=True),  # TableQuery already encoded it
+                json=data if method != "GET" else None,
+                headers=self.headers,
+                auth=self.auth,
+            ) as response:
+                if response.status in [200, 201]:
+                    result = (await response.json(content_type=None)).get("result")
+                    if not result:
+                        return {
+                            **ERRORS["EMPTY_DATA"],
+                            "details": "No data returned by ServiceNow",
+                        }
+                    return {**SUCCESS, "data": result}
+                elif response.status == 404:
+                    return ERRORS["NOT_FOUND"]
+                elif response.status == 401:
+                    return ERRORS["UNAUTHORIZED"]
+                else:
+                    return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": await response.text()}
+
+        except asyncio.TimeoutError:
+            return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": "ServiceNow request timed out"}
+        except aiohttp.ClientError as error:
             return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": str(error)}
         
-    async def get_user_sys_id_by_employee_number(self, employee_number):
-        url = f"{self.base_url}sys_user?sysparm_query=employee_number={employee_number}&sysparm_fields=sys_id"
-        response = self._make_request("GET", url)
-        if response.get("code") == 200 and response.get("data"):
-            return response["data"][0]["sys_id"]
-        
-        return None
+    def on_call_started(self):
+        """First point with a running loop, spooled creates left by earlier jobs start draining here"""
+        if self.spool:
+            self.spool.ensure_draining()
+
+    async def _submit_spooled(self, table, payload):
+        fields = REQUEST_FIELDS if table == "sc_request" else "sys_id,number"
+        return await self._make_request("POST", self.table(table).fields(fields).url(), payload)
+
+    def _on_spooled_done(self, table, ref, record):
+        if table == "sc_request":
+            self._cache_request(record)
+
+    def table(self, name) -> TableQuery:
+        return TableQuery(self.base_url, name)
+
+    async def prefetch_caller(self, phone_number):
+        """
+        Look up the caller's sys_user record and recent requests by the SIP phone number.
+        Started by CallState when the job starts so it runs while the greeting plays.
+        """
+        digits = re.sub(r"\D", "", phone_number or "")
+        if not digits:
+            return None
+        national = digits[-10:]
+        query = self.table("sys_user").fields("sys_id,employee_number,name,user_name").limit(1)
+        for field in ("mobile_phone", "phone"):
+            for value in dict.fromkeys((phone_number, national)):
+                query.or_where(field, value)
+        response = await self._make_request("GET", query.url())
+        if response.get("code") != 200 or not response.get("data"):
+            print(f"No ServiceNow profile found for caller {phone_number}")
+            return None
+        profile = response["data"][0]
+
+        query = (
+            self.table("sc_request")
+            .where("requested_for", profile["sys_id"])
+            .order_by("sys_created_on", descending=True)
+            .fields(REQUEST_FIELDS)
+            .limit(5)
+        )
+        response = await self._make_request("GET", query.url())
+        requests = response.get("data", []) if response.get("code") == 200 else []
+        for request in requests:
+            self._cache_request(request)
+
+        print(f"Prefetched ServiceNow profile for caller {phone_number}")
+        return {"profile": profile, "requests": requests}
+
+    async def get_user_sys_id_by_employee_number(self, employee_number, call_state=None):
+        employee_number = str(employee_number)
+        if call_state and employee_number in call_state.sys_ids:
+            return call_state.sys_ids[employee_number]
+
+        sys_id = self.sys_id_cache.get(employee_number, MISSING)
+        if sys_id is MISSING and call_state:
+            # the phone prefetch only if it already finished, a lookup is never held up waiting for it
+            profile = await call_state.caller_profile(timeout=0)
+            if profile and str(profile.get("employee_number")) == employee_number:
+                sys_id = profile["sys_id"]
+        if sys_id is MISSING:
+            query = self.table("sys_user").where("employee_number", employee_number).fields("sys_id").limit(1)
+            response = await self._make_request("GET", query.url())
+            if response.get("code") == 200 and response.get("data"):
+                sys_id = response["data"][0]["sys_id"]
+                self.sys_id_cache.set(employee_number, sys_id)
+            elif response.get("code") in (404, 422):
+                # ServiceNow answered and the employee does not exist, remember that briefly
+                sys_id = None
+                self.sys_id_cache.set(employee_number, None, ttl=self.sys_id_negative_ttl)
+            else:
+                return None
+
+        if call_state:
+            call_state.sys_ids[employee_number] = sys_id
+        return sys_id
 
     async def create_ticket(self, **kwargs):
         employee_number = kwargs.get('employeeId')
@@ -153,14 +252,15 @@ class ServiceNow(ServiceNowBase):
         assignee = kwargs.get('assignee')
         emp_sys_id = kwargs.get('emp_sys_id')
         name = kwargs.get('name')  # passed in JSON function definition but not used here
+        call_state = kwargs.get('call_state')
         
         if employee_number:
-            user_sys_id = await self.get_user_sys_id_by_employee_number(employee_number)
+            user_sys_id = await self.get_user_sys_id_by_employee_number(employee_number, call_state)
         else:
             user_sys_id = emp_sys_id
 
         if user_sys_id:
-            url = f"{self.base_url}incident"
+            url = self.table("incident").fields("sys_id,number").url()
             data = {
                 "short_description": subject,
                 "description": description,
@@ -172,9 +272,23 @@ class ServiceNow(ServiceNowBase):
                 data["assigned_to"] = assignee
             if state:
                 data["state"] = state
-            response = self._make_request("POST", url, data)
+
+            if self.spool:
+                ref = new_reference()
+                data["description"] = f"{description}\n\nVoice agent reference: {ref}"
+                await self.spool.enqueue("incident", data, ref=ref)
+                return {
+                    "status": "queued",
+                    "Reference Number": ref,
+                    "Status": "Ticket Queued",
+                    "Note": "The incident number is issued shortly, the reference number can be used to check on it",
+                }
+
+            response = await self._make_request("POST", url, data)
+            if response.get("code") != 200:
+                return response
             incident_number = response.get("data", {}).get("number")
-            return {"Incident Number": incident_number, "Status": "Ticket Created"}
+            return {"status": "success", "Incident Number": incident_number, "Status": "Ticket Created"}
         
         return ERRORS["NOT_FOUND"]
 
@@ -184,24 +298,38 @@ class ServiceNow(ServiceNowBase):
         employee_number = kwargs.get('employeeId')
         description = kwargs.get('issueDescription')
         justification = kwargs.get('justification')
+        call_state = kwargs.get('call_state')
         
         if employee_number:
-            caller_sys_id = await self.get_user_sys_id_by_employee_number(employee_number)
+            caller_sys_id = await self.get_user_sys_id_by_employee_number(employee_number, call_state)
             if not caller_sys_id:
                 return ERRORS["NOT_FOUND"]
             
-            url = f"{self.base_url}sc_request"
+            url = self.table("sc_request").fields(REQUEST_FIELDS).url()
             data = {
                 "short_description": justification,
                 "description": description,
                 "caller_id": caller_sys_id,
                 "requested_for": caller_sys_id,
             }
+
+            if self.spool:
+                ref = new_reference()
+                data["description"] = f"{description}\n\nVoice agent reference: {ref}"
+                await self.spool.enqueue("sc_request", data, ref=ref)
+                return {
+                    "status": "queued",
+                    "Request_Number": ref,
+                    "ManagersApproval": "Pending",
+                    "Status": "Request Queued",
+                }
             
-            response = self._make_request("POST", url, data)
+            response = await self._make_request("POST", url, data)
             if response.get("code") == 200:
+                self._cache_request(response["data"])
                 request_number = response.get("data", {}).get("number", "")
                 return {
+                    "status": "success",
                     "Request_Number": request_number,
                     "ManagersApproval": "Pending",
                     "Notification sent to Manager": "Yes",
@@ -212,57 +340,160 @@ class ServiceNow(ServiceNowBase):
     
     async def get_request_by_number(self, **kwargs):
         request_number = kwargs.get('requestNumber', '')
-        url = f"{self.base_url}sc_request?number={request_number}"
-        
-        response = self._make_request("GET", url)
-        
-        if response["code"] == 200 and response.get("data"):
-            request_data = response["data"][0]
-            return {
-                "short_description": request_data.get("short_description", ""),
-                "approval_status": request_data.get("approval", "Pending"),
-                "justification": request_data.get("description", ""),
-            }
+        call_state = kwargs.get('call_state')
+
+        if not request_number:
+            request_number = await self._latest_request_number(call_state)
+
+        if request_number.startswith("REF-"):
+            if self.spool and self.spool.is_pending(request_number):
+                return {"status": "queued", "message": f"{request_number} is still being submitted to ServiceNow"}
+            spooled = self.spool.resolve(request_number) if self.spool else None
+            if spooled is None:
+                # spooled by another worker, before a restart or too long ago to be remembered here
+                request = await self._find_request_by_reference(request_number)
+                if request:
+                    return self._format_request(request)
+                return {**ERRORS["NOT_FOUND"], "details": f"No request with reference {request_number} in ServiceNow yet"}
+            if not spooled.get("number"):
+                return {**ERRORS["INTERNAL_SERVER_ERROR"], "details": f"{request_number} could not be submitted"}
+            request_number = spooled["number"]
+
+        # approval status changes outside the call, always read it fresh (this also refreshes the cache)
+        request = await self._fetch_request_record(request_number) if request_number else None
+        if request:
+            return self._format_request(request)
         
         return ERRORS["NOT_FOUND"]
+
+    def _format_request(self, request_data):
+        return {
+            "short_description": request_data.get("short_description", ""),
+            "approval_status": request_data.get("approval", "Pending"),
+            "justification": request_data.get("description", ""),
+        }
+
+    async def _latest_request_number(self, call_state):
+        """The caller's newest request from the prefetch (which also filled the request cache)"""
+        caller = await call_state.caller() if call_state else None
+        if caller and caller["requests"]:
+            return caller["requests"][0].get("number", "")
+        return ""
+
+    def _cache_request(self, record):
+        if record and record.get("number") and record.get("sys_id"):
+            self.request_cache.set(
+                record["number"],
+                {field: record.get(field) for field in REQUEST_FIELDS.split(",")},
+            )
+
+    async def _get_request_record(self, request_number):
+        """sc_request record with sys_id, from the request cache or one projected GET"""
+        request = self.request_cache.get(request_number)
+        if request:
+            return request
+        return await self._fetch_request_record(request_number)
+
+    async def _find_request_by_reference(self, ref):
+        """sc_request created from the write-behind spool, found by the reference in its description"""
+        query = self.table("sc_request").where("description", ref, "LIKE").fields(REQUEST_FIELDS).limit(1)
+        response = await self._make_request("GET", query.url())
+        if response["code"] == 200 and response.get("data"):
+            self._cache_request(response["data"][0])
+            return response["data"][0]
+        return None
+
+    async def _fetch_request_record(self, request_number):
+        """sc_request record from one projected GET, which also refreshes the request cache"""
+        query = self.table("sc_request").where("number", request_number).fields(REQUEST_FIELDS).limit(1)
+        response = await self._make_request("GET", query.url())
+        if response["code"] == 200 and response.get("data"):
+            self._cache_request(response["data"][0])
+            return response["data"][0]
+        return None
         
     async def update_request_by_sys_id(self, **kwargs):
         request_number = kwargs.get('requestNumber', '')
         description = kwargs.get('issueDescription', '')
         justification = kwargs.get('justification', '')
-        
-        request = await self.get_request_by_number({"requestNumber": request_number})
-        
-        if isinstance(request, dict) and "error" in request:
-            return request
-        
-        url = f"{self.base_url}sc_request/{request['sys_id']}"
+        call_state = kwargs.get('call_state')
+
+        if not request_number:
+            request_number = await self._latest_request_number(call_state)
+
+        request = await self._get_request_record(request_number) if request_number else None
+        if not request:
+            return ERRORS["NOT_FOUND"]
+
+        if self.update_conflict_check and request.get("sys_mod_count") is not None:
+            query = self.table("sc_request").record(request["sys_id"]).fields("sys_mod_count")
+            current = await self._make_request("GET", query.url())
+            if current["code"] == 200 and str(current["data"].get("sys_mod_count")) != str(request["sys_mod_count"]):
+                self.request_cache.invalidate(request_number)
+                return {**ERRORS["CONFLICT"], "details": f"{request_number} changed since it was last read"}
+
         update_data = {
             "short_description": justification,
             "description": description,
         }
         
-        response = self._make_request("PUT", url, update_data)
+        url = self.table("sc_request").record(request["sys_id"]).fields(REQUEST_FIELDS).url()
+        response = await self._make_request("PATCH", url, update_data)
+        if response["code"] == 200:
+            self._cache_request(response["data"])
+        else:
+            self.request_cache.invalidate(request_number)
         return {
+            "status": "success" if response["code"] == 200 else "error",
             "result": json.dumps({
                 "status": "success" if response["code"] == 200 else "error",
                 "message": "Request updated successfully" if response["code"] == 200 else "Failed to update request"
             })
         }
     
+    async def _get_employee_from_servicenow(self, employee_id, call_state=None):
+        """Fallback for employees missing from the snapshot (e.g. hired after it was built)"""
+        query = self.table("sys_user").where("employee_number", employee_id).fields("sys_id,name,user_name").limit(1)
+        response = await self._make_request("GET", query.url())
+        if response.get("code") != 200 or not response.get("data"):
+            return None
+        user = response["data"][0]
+        # the follow-up create_ticket/create_request will need the sys_id
+        self.sys_id_cache.set(employee_id, user["sys_id"])
+        if call_state:
+            call_state.sys_ids[employee_id] = user["sys_id"]
+        return {
+            "employee_id": employee_id,
+            "name": user.get("name", ""),
+            "username": user.get("user_name", ""),
+        }
+
     async def verify_employee(self, **kwargs):
-        employee_details = [
-            {
-                "employee_id": "9080",
-                "name": "Mridul Rao",
-                "username": "mridul.rao",
-            }
-        ]
         employee_id = str(kwargs.get('employeeId', ''))
-        for employee in employee_details:
-            if employee["employee_id"] == employee_id:
-                print("Verification Successful")
-                return {"status": "success", "employee_details": employee}
+        call_state = kwargs.get('call_state')
+
+        employee = self.employee_store.get(employee_id)
+
+        # the record looked up from the caller's phone number while the greeting played, only if that
+        # lookup already finished, verification never waits on ServiceNow for it
+        profile = await call_state.caller_profile(timeout=0) if call_state else None
+        if profile and str(profile.get("employee_number")) == employee_id:
+            if profile.get("sys_id"):
+                call_state.sys_ids[employee_id] = profile["sys_id"]
+            if employee is None:
+                employee = {
+                    "employee_id": employee_id,
+                    "name": profile.get("name", ""),
+                    "username": profile.get("user_name", ""),
+                }
+
+        if employee is None and self.verify_fallback and employee_id:
+            employee = await self._get_employee_from_servicenow(employee_id, call_state)
+        if employee:
+            if call_state and employee.get("sys_id"):
+                call_state.sys_ids[employee_id] = employee["sys_id"]
+            print("Verification Successful")
+            return {"status": "success", "employee_details": employee}
             
         print("Verification Failed")
         return {"status": "error", "message": "Employee not found"}
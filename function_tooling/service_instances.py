@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from psuedo_servicenow import ServiceNow
 from psuedo_ms365group import MS365Group
@@ -21,6 +22,9 @@ class ServiceInstances:
                 
                 logger.info("Initializing MS365 Group...")
                 self.ms365group = MS365Group()
+
+                logger.info("Warming up service caches...")
+                self._run_warm_up()
                 
                 self._initialized = True
                 logger.info("All services initialized successfully")
@@ -28,6 +32,18 @@ class ServiceInstances:
                 logger.error(f"Error initializing services: {str(e)}")
                 raise
 
+    def _run_warm_up(self):
+        # prewarm runs before the job loop exists, so warm-ups get their own short-lived loop
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self._warm_up())
+        else:
+            logger.warning("Event loop already running, skipping service warm-up")
+
+    async def _warm_up(self):
+        await self.ms365group.warm_up()
+
     def get_service_now(self):
         return self.servicenow
 
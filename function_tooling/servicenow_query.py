@@ -0,0 +1,75 @@
+from urllib.parse import urlencode, quote
+
+
+'''
+Builder for ServiceNow Table API URLs.
+Every URL it produces carries sysparm_fields, sysparm_limit (list reads) and
+sysparm_exclude_reference_link, so reads only pull the columns the tools use.
+Values are stripped of '^' so spoken input cannot add conditions to the encoded query.
+
+    ServiceNow.table("sys_user").where("employee_number", "9080").fields("sys_id").limit(1).url()
+'''
+
+DEFAULT_LIMIT = 10
+
+
+class TableQuery:
+    def __init__(self, base_url, table):
+        self.base_url = base_url
+        self.table = table
+        self._conditions = []
+        self._order_by = None
+        self._fields = None
+        self._limit = DEFAULT_LIMIT
+        self._sys_id = None
+
+    def where(self, field, value, operator="="):
+        self._conditions.append(("^" if self._conditions else "", field, operator, value))
+        return self
+
+    def or_where(self, field, value, operator="="):
+        self._conditions.append(("^OR" if self._conditions else "", field, operator, value))
+        return self
+
+    def order_by(self, field, descending=False):
+        self._order_by = f"ORDERBY{'DESC' if descending else ''}{field}"
+        return self
+
+    def fields(self, *fields):
+        # accepts fields("a", "b") or fields("a,b")
+        self._fields = ",".join(field for group in fields for field in group.split(","))
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def record(self, sys_id):
+        """Address a single record, /table/{sys_id}"""
+        self._sys_id = sys_id
+        return self
+
+    def encoded_query(self):
+        query = "".join(
+            f"{joiner}{field}{operator}{str(value).replace('^', '')}"
+            for joiner, field, operator, value in self._conditions
+        )
+        if self._order_by:
+            query = f"{query}^{self._order_by}" if query else self._order_by
+        return query
+
+    def url(self):
+        if not self._fields:
+            raise ValueError(f"Query on {self.table} has no field projection")
+
+        params = {}
+        if self._sys_id is None:
+            query = self.encoded_query()
+            if query:
+                params["sysparm_query"] = query
+            params["sysparm_limit"] = self._limit
+        params["sysparm_fields"] = self._fields
+        params["sysparm_exclude_reference_link"] = "true"
+
+        path = self.table if self._sys_id is None else f"{self.table}/{quote(self._sys_id)}"
+        return f"{self.base_url}{path}?{urlencode(params, quote_via=quote, safe=',')}"
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Keeps the MSAL app-only token warm for the lifetime of the worker process.
+The token is fetched once in prewarm, then a background task refreshes it shortly before it expires,
+so tool calls read the Authorization header from memory and never wait on Azure AD.
+Concurrent callers that do hit an expired token share a single in-flight refresh.
+
+MSAL only hands out a new token once the cached one is within 5 minutes of expiry, so the refresh
+margin has to stay below that or the refresh just returns the same token.
+'''
+
+
+class TokenManager:
+    def __init__(self, client, scope, refresh_margin=None):
+        self.client = client
+        self.scope = scope
+        self.refresh_margin = refresh_margin or float(os.getenv("GRAPH_TOKEN_REFRESH_MARGIN", "240"))
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_task = None
+        self._background_task = None
+
+    def acquire_blocking(self):
+        """Synchronous fetch, used in prewarm where there is no event loop yet"""
+        self._store(self.client.acquire_token_for_client(scopes=self.scope))
+
+    def _store(self, token_result):
+        if not token_result or "access_token" not in token_result:
+            raise Exception("Failed to acquire access token")
+        self._token = token_result["access_token"]
+        self._expires_at = time.monotonic() + int(token_result.get("expires_in", 3599))
+        logger.debug(f"Graph token refreshed, expires in {int(token_result.get('expires_in', 3599))}s")
+
+    @property
+    def expired(self):
+        return self._token is None or time.monotonic() >= self._expires_at - 30
+
+    def authorization_header(self):
+        return f"Bearer {self._token}"
+
+    async def ensure_fresh(self):
+        """Called before every Graph request. Only waits when the token is actually unusable."""
+        self._ensure_background_refresh()
+        if self.expired:
+            await self.refresh()
+
+    async def refresh(self):
+        loop = asyncio.get_running_loop()
+        if (
+            self._refresh_task is None
+            or self._refresh_task.done()
+            or self._refresh_task.get_loop() is not loop
+        ):
+            self._refresh_task = loop.create_task(self._do_refresh())
+        # shield so a cancelled tool call does not cancel the refresh other callers are waiting on
+        await asyncio.shield(self._refresh_task)
+
+    async def _do_refresh(self):
+        # msal is synchronous, keep it off the event loop
+        token_result = await asyncio.to_thread(
+            self.client.acquire_token_for_client, scopes=self.scope
+        )
+        self._store(token_result)
+
+    def _ensure_background_refresh(self):
+        loop = asyncio.get_running_loop()
+        if (
+            self._background_task is not None
+            and not self._background_task.done()
+            and self._background_task.get_loop() is loop
+        ):
+            return
+        self._background_task = loop.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        while True:
+            delay = self._expires_at - self.refresh_margin - time.monotonic()
+            await asyncio.sleep(max(delay, 5))
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Background Graph token refresh failed: {str(e)}")
+                await asyncio.sleep(30)
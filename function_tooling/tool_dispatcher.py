@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Runs the tool calls of one LLM turn concurrently, one dispatcher per ServiceDeskFunctionContext.
+
+VoicePipelineAgent emits "function_calls_collected" with every call of the turn and then awaits the
+calls one after another. schedule_turn() starts them all as tasks straight away, so when the agent
+invokes each callable, run() just awaits the task that is already running and the turn takes as long
+as its slowest call instead of the sum.
+
+Ordering and limits come from the FunctionMapper:
+    function_dependencies - a call waits for those tools if they are part of the same turn
+    backend_concurrency   - max calls of this phone call running against a backend at once
+'''
+
+
+def call_key(name, kwargs):
+    return name, json.dumps(kwargs or {}, sort_keys=True, default=str)
+
+
+class ToolDispatcher:
+    def __init__(self, mapper, execute):
+        """execute: async (name, kwargs) -> tool result, the context's own executor"""
+        self.mapper = mapper
+        self.execute = execute
+        self._semaphores = {
+            backend: asyncio.Semaphore(limit) for backend, limit in mapper.backend_concurrency.items()
+        }
+        self._scheduled = {}   # call_key -> [tasks], started by schedule_turn and not yet claimed by run()
+
+    def schedule_turn(self, calls):
+        """calls: [(name, kwargs)] in the order the LLM emitted them"""
+        # anything left over belongs to an interrupted turn, the agent will not ask for it again
+        self._scheduled = {}
+        if len(calls) < 2:
+            return
+
+        started = {}   # name -> tasks of this turn
+        remaining = list(calls)
+        while remaining:
+            # start the calls none of whose dependencies are still waiting, in emitted order
+            waiting = {name for name, _ in remaining}
+            ready = [
+                call for call in remaining
+                if not waiting.intersection(self.mapper.function_dependencies.get(call[0], ()))
+            ] or remaining[:1]   # dependency cycle, fall back to emitted order
+            for name, kwargs in ready:
+                deps = [
+                    task
+                    for dep in self.mapper.function_dependencies.get(name, ())
+                    for task in started.get(dep, ())
+                ]
+                task = asyncio.create_task(self._run_after(deps, name, kwargs))
+                started.setdefault(name, []).append(task)
+                self._scheduled.setdefault(call_key(name, kwargs), []).append(task)
+                remaining.remove((name, kwargs))
+
+        logger.debug(f"Started {len(calls)} tool calls concurrently: {[name for name, _ in calls]}")
+
+    async def run(self, name, kwargs):
+        tasks = self._scheduled.get(call_key(name, kwargs))
+        if tasks:
+            task = tasks.pop(0)
+            if not tasks:
+                del self._scheduled[call_key(name, kwargs)]
+            return await task
+        return await self._limited(name, kwargs)
+
+    async def _run_after(self, deps, name, kwargs):
+        if deps:
+            # failed or cancelled dependencies still release the dependent call, as in sequential order
+            await asyncio.wait(deps)
+        return await self._limited(name, kwargs)
+
+    async def _limited(self, name, kwargs):
+        semaphore = self._semaphores.get(self.mapper.function_backend.get(name))
+        if semaphore is None:
+            return await self.execute(name, kwargs)
+        async with semaphore:
+            return await self.execute(name, kwargs)
@@ -0,0 +1,71 @@
+import os
+from types import MappingProxyType
+
+
+'''
+Conversation phases of a call and the tools the LLM is shown in each one.
+Every request to the model carries the schemas of ServiceDeskFunctionContext.ai_functions, which is
+the subset for CallState.phase, so e.g. an unverified caller's turns only send verify_employee.
+
+    unverified - until verify_employee succeeds
+    triage     - verified, the LLM picks a troubleshooting guide or an action
+    action     - a guide is being walked through or a ServiceNow / MS365 action is in progress,
+                 the guides stay visible so a second issue can still get its guide
+    wrap_up    - a ticket or request was created/updated (or queued), follow-ups or a new issue
+
+TOOL_PHASES=0 shows every tool in every phase.
+'''
+
+UNVERIFIED = "unverified"
+TRIAGE = "triage"
+ACTION = "action"
+WRAP_UP = "wrap_up"
+
+ENABLED = os.getenv("TOOL_PHASES", "1").lower() not in ("0", "false")
+
+ACTION_TOOLS = frozenset({
+    'next_troubleshooting_step',
+    'create_ticket',
+    'create_service_request',
+    'get_service_request',
+    'update_service_request',
+    'create_distribution_list',
+    'add_users_to_distribution_list',
+    'remove_users_from_distribution_list',
+    'send_email_to_group',
+    'schedule_meeting',
+})
+
+# a successful call of these finishes the action
+COMPLETING_TOOLS = frozenset({'create_ticket', 'create_service_request', 'update_service_request'})
+
+# read only, does not move the call out of triage / wrap-up
+LOOKUP_TOOLS = frozenset({'get_service_request'})
+
+
+def phase_tools(names, guides=()):
+    """phase -> frozenset of tool names, from every tool name in the registry and the guide tool names"""
+    names = frozenset(names)
+    triage = names - {'verify_employee', 'next_troubleshooting_step', 'update_service_request'}
+    return MappingProxyType({
+        UNVERIFIED: names & {'verify_employee'},
+        TRIAGE: triage,
+        ACTION: names & (ACTION_TOOLS | frozenset(guides)),
+        WRAP_UP: triage | (names & {'update_service_request'}),
+    })
+
+
+def succeeded(result):
+    # a create that was spooled (write_behind) is accepted, it is submitted to ServiceNow shortly
+    return isinstance(result, dict) and (result.get("status") in ("success", "queued") or result.get("code") == 200)
+
+
+def next_phase(phase, name, result=None):
+    """Phase after tool `name` returned `result` (None for the cached troubleshooting guides)"""
+    if name == 'verify_employee':
+        return TRIAGE if phase == UNVERIFIED and succeeded(result) else phase
+    if phase == UNVERIFIED or name in LOOKUP_TOOLS:
+        return phase
+    if name in COMPLETING_TOOLS and succeeded(result):
+        return WRAP_UP
+    return ACTION
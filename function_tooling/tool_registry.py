@@ -0,0 +1,106 @@
+import inspect
+from contextvars import ContextVar
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from livekit.agents.llm import FunctionInfo, FunctionArgInfo
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from function_tooling.function_handelling import FunctionMapper
+from function_tooling.intent_router import IntentRouter
+from function_tooling.tool_phases import phase_tools
+
+
+'''
+The tool definitions compiled once per worker process (in prewarm) instead of once per call.
+JSON definitions from function_def_prompts are parsed into frozen ToolSpecs, and the FunctionInfos the
+LLM sees (all of them and each phase's subset) and the FunctionMapper are built here too, so setting
+up a job allocates nothing per tool.
+
+A FunctionInfo's callable looks up the executor of the call it runs in through current_dispatch.
+ServiceDeskFunctionContext sets it in the job's entrypoint, and the agent's tasks are started from
+there, so each job's tool calls reach their own context.
+
+The mapper holds no per-call state (that lives in each call's CallState and kwargs), so every
+call in the process dispatches through the same instance concurrently without cross-talk.
+The mapper also renders the troubleshooting guides to their final text (guide_cache), and the
+intent router indexes them.
+'''
+
+# dispatch(name, kwargs) of the call whose tasks are running, see ServiceDeskFunctionContext
+current_dispatch = ContextVar("current_dispatch")
+
+JSON_TYPES = MappingProxyType({
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+})
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    name: str
+    description: str
+    auto_retry: bool
+    arguments: MappingProxyType
+
+
+class ToolRegistry:
+    def __init__(self, json_definitions: list[dict], servicenow=None, ms365group=None):
+        self.specs = MappingProxyType({
+            fn_def["name"]: self._compile(fn_def) for fn_def in json_definitions
+        })
+        self.mapper = FunctionMapper(servicenow, ms365group)
+        self.guides = self.mapper.guides
+        self.router = IntentRouter(self.guides, json_definitions)
+        self.phases = phase_tools(self.specs, self.guides)
+
+        self.functions = MappingProxyType({
+            name: FunctionInfo(
+                name=name,
+                description=spec.description,
+                auto_retry=spec.auto_retry,
+                callable=self._callable(name),
+                arguments=spec.arguments,
+            )
+            for name, spec in self.specs.items()
+        })
+        self.phase_functions = MappingProxyType({
+            phase: MappingProxyType({name: fnc for name, fnc in self.functions.items() if name in names})
+            for phase, names in self.phases.items()
+        })
+
+    @staticmethod
+    def _callable(name: str):
+        async def dispatch_tool(**kwargs):
+            return await current_dispatch.get()(name, kwargs)
+        return dispatch_tool
+
+    def _compile(self, fn_def: dict) -> ToolSpec:
+        args_info = {}
+        if "parameters" in fn_def:
+            properties = fn_def["parameters"].get("properties", {})
+            required = fn_def["parameters"].get("required", [])
+
+            for arg_name, arg_def in properties.items():
+                default = inspect.Parameter.empty if arg_name in required else None
+                args_info[arg_name] = FunctionArgInfo(
+                    name=arg_name,
+                    description=arg_def.get("description", ""),
+                    type=JSON_TYPES.get(arg_def["type"], str),
+                    default=default,
+                    choices=tuple(arg_def.get("enum", [])) if "enum" in arg_def else None
+                )
+
+        return ToolSpec(
+            name=fn_def["name"],
+            description=fn_def.get("description", ""),
+            # the agents never auto retry our tools unless a definition asks for it
+            auto_retry=fn_def.get("auto_retry", False),
+            arguments=MappingProxyType(args_info),
+        )
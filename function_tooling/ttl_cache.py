@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+
+
+'''
+Small in-process LRU cache with per-entry expiry.
+Backends are per-process singletons (see service_instances), so a cache held on a backend
+is shared by every call the worker process hosts. Not thread safe, it is only touched from the event loop.
+'''
+
+# pass as `default` to tell a miss apart from a cached None (negative caching)
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, MISSING)
+        if entry is MISSING:
+            return default
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,199 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Durable write-behind queue for ServiceNow creates (SERVICENOW_WRITE_BEHIND=1).
+
+The tool reserves a local reference (e.g. REF-3F9A1C), appends the payload to an append-only JSONL
+spool and answers straight away. A background task drains the spool to ServiceNow with retries and
+appends a "done" line linking the reference to the real incident/request number.
+
+Each worker process writes its own spool file and holds an flock on it. On startup a process
+adopts the spool files of processes that died (their lock is free) so nothing queued is lost.
+
+Spool lines:
+    {"op": "enqueue", "ref", "table", "payload", "ts"}
+    {"op": "done", "ref", "number", "sys_id"}
+    {"op": "failed", "ref", "error"}
+Entries that still fail after SERVICENOW_SPOOL_MAX_ATTEMPTS are copied to failed.jsonl for follow-up.
+'''
+
+
+def new_reference():
+    return f"REF-{uuid.uuid4().hex[:6].upper()}"
+
+
+class WriteBehindSpool:
+    def __init__(self, submit, spool_dir=None, max_attempts=None, retry_base=None, on_done=None):
+        """
+        submit: async (table, payload) -> ServiceNow result dict, success when code == 200
+        on_done: optional callback (table, ref, record) once an entry reached ServiceNow
+        """
+        self.submit = submit
+        self.on_done = on_done
+        self.spool_dir = Path(spool_dir or os.getenv("SERVICENOW_SPOOL_DIR") or Path(__file__).parent / "spool")
+        self.max_attempts = max_attempts or int(os.getenv("SERVICENOW_SPOOL_MAX_ATTEMPTS", "8"))
+        self.retry_base = retry_base or float(os.getenv("SERVICENOW_SPOOL_RETRY_BASE", "2"))
+        self.pending = {}   # ref -> {"table", "payload"}, in enqueue order
+        self.results = TTLCache(maxsize=4096, ttl=86400)   # ref -> {"number", "sys_id"} or {"error"}
+        self._file = None
+        self._file_lock = threading.Lock()  # appends run in worker threads
+        self._enqueues_in_flight = 0        # enqueue lines being written, not in pending yet
+        self._drain_task = None
+        self._wakeup = None
+        self._wakeup_loop = None
+
+    def open(self):
+        """Called once from prewarm: lock our own spool file and adopt orphaned ones"""
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"spool-{os.getpid()}.jsonl"
+        # locked under a name the other workers do not adopt, then renamed, so no sibling can
+        # see our spool unlocked and take it over
+        tmp_path = path.with_suffix(".jsonl.tmp")
+        self._file = open(tmp_path, "a+", encoding="utf-8")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.replace(tmp_path, path)
+
+        for orphan in sorted(self.spool_dir.glob("spool-*.jsonl")):
+            if orphan == path:
+                continue
+            self._adopt(orphan)
+        if self.pending:
+            logger.info(f"Write-behind spool has {len(self.pending)} entries to drain")
+
+    def _adopt(self, orphan):
+        try:
+            f = open(orphan, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            return  # adopted by another worker meanwhile
+        with f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # owned by a live process
+            try:
+                if os.stat(orphan).st_ino != os.fstat(f.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                return  # another worker adopted and deleted it before we got the lock
+            pending = {}
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from a crash
+                if entry["op"] == "enqueue":
+                    pending[entry["ref"]] = entry
+                else:
+                    pending.pop(entry["ref"], None)
+            # re-spool into our file before deleting theirs, so a crash in between loses nothing
+            for entry in pending.values():
+                self._append(entry)
+                self.pending[entry["ref"]] = {"table": entry["table"], "payload": entry["payload"]}
+            # still holding the lock, a worker waiting for it then finds the file gone
+            orphan.unlink()
+
+    def _append(self, entry):
+        with self._file_lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    async def enqueue(self, table, payload, ref=None):
+        ref = ref or new_reference()
+        entry = {"op": "enqueue", "ref": ref, "table": table, "payload": payload, "ts": time.time()}
+        # fsync off the event loop, _compact must not truncate the spool while the line is written
+        self._enqueues_in_flight += 1
+        try:
+            await asyncio.to_thread(self._append, entry)
+        finally:
+            self._enqueues_in_flight -= 1
+        self.pending[ref] = {"table": table, "payload": payload}
+        self.ensure_draining()
+        self._wakeup.set()
+        return ref
+
+    def is_pending(self, ref):
+        """Queued in this process and not submitted yet"""
+        return ref in self.pending
+
+    def resolve(self, ref):
+        """
+        {"number", "sys_id"} or {"error"} for a ref this process finished, None while it is pending or
+        when this process never saw it (another worker, before a restart, past the results TTL)
+        """
+        return self.results.get(ref)
+
+    def ensure_draining(self):
+        loop = asyncio.get_running_loop()
+        if self._wakeup_loop is not loop:
+            self._wakeup = asyncio.Event()
+            self._wakeup_loop = loop
+        if self._drain_task is None or self._drain_task.done() or self._drain_task.get_loop() is not loop:
+            self._drain_task = loop.create_task(self._drain())
+
+    async def _drain(self):
+        attempts = {}
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                self._compact()
+                await self._wakeup.wait()
+                continue
+
+            ref, entry = next(iter(self.pending.items()))
+            try:
+                result = await self.submit(entry["table"], entry["payload"])
+            except Exception as e:
+                result = {"code": 500, "details": str(e)}
+
+            if result.get("code") == 200:
+                record = result.get("data") or {}
+                await self._finish(ref, {"op": "done", "ref": ref, "number": record.get("number"), "sys_id": record.get("sys_id")})
+                logger.info(f"Write-behind {ref} created as {record.get('number')}")
+                if self.on_done:
+                    self.on_done(entry["table"], ref, record)
+                attempts.pop(ref, None)
+                continue
+
+            attempts[ref] = attempts.get(ref, 0) + 1
+            if attempts[ref] >= self.max_attempts:
+                logger.error(f"Write-behind {ref} failed after {attempts[ref]} attempts: {result}")
+                await asyncio.to_thread(self._dead_letter, ref, entry, result)
+                await self._finish(ref, {"op": "failed", "ref": ref, "error": str(result.get("details", result.get("message")))})
+                attempts.pop(ref)
+                continue
+
+            delay = min(self.retry_base ** attempts[ref], 300)
+            logger.warning(f"Write-behind {ref} attempt {attempts[ref]} failed, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+    async def _finish(self, ref, entry):
+        await asyncio.to_thread(self._append, entry)
+        self.pending.pop(ref, None)
+        self.results.set(ref, {key: value for key, value in entry.items() if key not in ("op", "ref")})
+
+    def _dead_letter(self, ref, entry, result):
+        with open(self.spool_dir / "failed.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ref": ref, **entry, "last_result": result, "ts": time.time()}, default=str) + "\n")
+
+    def _compact(self):
+        # everything reached ServiceNow (or gave up), the spool can start over
+        if self._enqueues_in_flight:
+            return
+        with self._file_lock:
+            if self._file.tell() > 0:
+                self._file.truncate(0)
+                self._file.seek(0)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import sys
 from pathlib import Path
+import os
 import re
 
 # Add parent directory to Python path
@@ -25,7 +26,9 @@ from livekit.plugins import openai
 
 #### FUNCTION TOOLING SETUP ####
 from function_tooling.function_tool_vva import ServiceDeskFunctionContext
+from function_tooling.tool_registry import ToolRegistry
 from function_tooling.function_def_prompts import functions
+from vva_logs.latency_metrics import TurnLatencyRecorder
 
 def extract_phone_number(room_name: str) -> str:
     """Extract phone number from room name format 'number-_+XXXXXXXXXX_XXXXX'"""
@@ -35,11 +38,6 @@ def extract_phone_number(room_name: str) -> str:
     return None
 
 
-updated_functions = []
-for func in functions: 
-    updated_func = func.copy()
-    updated_func["auto_retry"] = False
-    updated_functions.append(updated_func)
 #### FUNCTION TOOLING SETUP ####
 
 
@@ -53,6 +51,11 @@ def prewarm(proc: JobProcess):
         
         # Store services in process userdata
         proc.userdata["services"] = services
+
+        # Compile the tool definitions once, every call in this process binds to them
+        proc.userdata["tool_registry"] = ToolRegistry(functions,
+                                                      services.get_service_now(),
+                                                      services.get_ms365_group())
         
         logger.info("Prewarm completed successfully")
     except Exception as e:
@@ -108,18 +111,26 @@ def run_multimodal_agent(ctx: JobContext, participant: rtc.RemoteParticipant):
 
     #updated_functions = prepare_functions_with_phone(functions, phone_number)
     services = ctx.proc.userdata["services"]
-    fnc_ctx = ServiceDeskFunctionContext(updated_functions, 
+    fnc_ctx = ServiceDeskFunctionContext(ctx.proc.userdata["tool_registry"],
                                          phone_number,
-                                         services.get_service_now(),
-                                         services.get_ms365_group())
+                                         services.get_service_now())
+    # look the caller up in ServiceNow while the greeting plays
+    fnc_ctx.start_prefetch()
 
     assistant = MultimodalAgent(model=model,
                                 fnc_ctx=fnc_ctx)
 
+    # per-turn waterfall (end of speech -> first audio) and process wide p50/p95/p99
+    latency = TurnLatencyRecorder(ctx.room.name)
+    latency.attach(assistant)
+    fnc_ctx.on_tool_timing = latency.on_tool_timing
+    ctx.add_shutdown_callback(latency.aclose)
     
     assistant.start(ctx.room, participant)
 
     session = model.sessions[0]
+    # the realtime session keeps the tool list it was given, resend it when the call phase changes
+    fnc_ctx.on_phase_change = lambda phase: session.session_update()
     session.conversation.item.create(
         llm.ChatMessage(
             role="assistant",
@@ -133,6 +144,8 @@ if __name__ == "__main__":
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
-            prewarm_fnc=prewarm
+            prewarm_fnc=prewarm,
+            # prewarm fetches the Graph token and loads the directory (bounded by DIRECTORY_PREWARM_TIMEOUT)
+            initialize_process_timeout=float(os.getenv("WORKER_INITIALIZE_TIMEOUT", "20")),
         )
     )
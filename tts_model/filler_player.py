@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from livekit import rtc
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Covers slow tool calls with a pre-rendered filler phrase ("I'm working on that now...").
+
+ServiceDeskFunctionContext calls on_slow_tool(name) when a tool is still running after
+SLOW_TOOL_THRESHOLD. FillerPlayer then plays that tool's phrase from instructions.TOOL_TIMING_PHRASES,
+or the next of FILLER_PHRASES, from the phrase cache on its own audio track. No LLM tokens or TTS
+requests are spent on it. It stays quiet while the agent is speaking and stops as soon as the agent
+or the caller starts talking.
+'''
+
+
+class FillerPlayer:
+    def __init__(self, phrase_cache, sentence_tokenizer, filler_phrases, tool_phrases=None):
+        # phrase -> [PcmAudio per sentence], only phrases whose every sentence is pre-rendered
+        self._clips = {}
+        for phrase in (*filler_phrases, *(tool_phrases or {}).values()):
+            audio = [phrase_cache.get(sentence) for sentence in sentence_tokenizer.tokenize(phrase)]
+            if audio and all(audio):
+                self._clips[phrase] = audio
+        self._filler_phrases = [phrase for phrase in filler_phrases if phrase in self._clips]
+        self._tool_phrases = {name: phrase for name, phrase in (tool_phrases or {}).items() if phrase in self._clips}
+        self._rotation = 0
+        self._agent_speaking = False
+        self._task = None
+        self.source = None
+        if not self._clips:
+            logger.warning("No pre-rendered filler phrases, slow tool calls will not be covered")
+            return
+        first = next(iter(self._clips.values()))[0]
+        self.source = rtc.AudioSource(first.sample_rate, first.num_channels)
+
+    async def publish(self, room):
+        if self.source is None:
+            return
+        track = rtc.LocalAudioTrack.create_audio_track("filler", self.source)
+        await room.local_participant.publish_track(
+            track, rtc.TrackPublishOptions(source=rtc.TrackSource.SOURCE_MICROPHONE)
+        )
+
+    def attach(self, agent):
+        """Follow the VoicePipelineAgent's speech so the filler never talks over it"""
+        @agent.on("agent_started_speaking")
+        def _agent_started():
+            self._agent_speaking = True
+            self.stop()
+
+        @agent.on("agent_stopped_speaking")
+        def _agent_stopped():
+            self._agent_speaking = False
+
+        @agent.on("user_started_speaking")
+        def _user_started():
+            self.stop()
+
+    @property
+    def playing(self):
+        return self._task is not None and not self._task.done()
+
+    def play(self, tool_name=None):
+        """on_slow_tool callback"""
+        if self.source is None or self._agent_speaking or self.playing:
+            return
+        phrase = self._tool_phrases.get(tool_name)
+        if phrase is None:
+            if not self._filler_phrases:
+                return
+            phrase = self._filler_phrases[self._rotation % len(self._filler_phrases)]
+            self._rotation += 1
+        logger.debug(f"Playing filler for slow tool {tool_name}: {phrase}")
+        self._task = asyncio.create_task(self._play(self._clips[phrase]))
+
+    def stop(self):
+        if self.playing:
+            self._task.cancel()
+        if self.source is not None:
+            # frames already captured keep playing from the source's buffer otherwise
+            self.source.clear_queue()
+
+    async def _play(self, clip):
+        for audio in clip:
+            for frame in audio.frames():
+                await self.source.capture_frame(frame)
@@ -1,5 +1,6 @@
 import sys
 from pathlib import Path
+import os
 import re
 
 # Add parent directory to Python path
@@ -17,10 +18,17 @@ from livekit.agents import (
     WorkerOptions,
     cli,
     llm,
+    tts,
 )
 from livekit.agents.pipeline import VoicePipelineAgent
 from livekit.plugins import openai, deepgram, silero
 
+from phrase_cache import PhraseCacheTTS, prepare_phrase_cache, TTS_MODEL, TTS_VOICE
+from tts_cache import CachingTTS, SynthesisCache
+from filler_player import FillerPlayer
+from speech_chunker import SpeechChunker
+from vva_logs.latency_metrics import TurnLatencyRecorder
+
 
 load_dotenv()
 logger = logging.getLogger()
@@ -28,6 +36,7 @@ logger = logging.getLogger()
 #### FUNCTION TOOLING SETUP ####
 
 from function_tooling.function_tool_vva import ServiceDeskFunctionContext
+from function_tooling.tool_registry import ToolRegistry
 from function_tooling.function_def_prompts import functions
 
 def extract_phone_number(room_name: str) -> str:
@@ -37,13 +46,6 @@ def extract_phone_number(room_name: str) -> str:
         return match.group(1)
     return None
 
-
-updated_functions = []
-for func in functions: 
-    updated_func = func.copy()
-    updated_func["auto_retry"] = False
-    updated_functions.append(updated_func)
-
 #### FUNCTION TOOLING SETUP ####
 
 
@@ -63,7 +65,25 @@ def prewarm(proc: JobProcess):
         
         # Store services in process userdata
         proc.userdata["services"] = services
+
+        # Compile the tool definitions once, every call in this process binds to them
+        proc.userdata["tool_registry"] = ToolRegistry(functions,
+                                                      services.get_service_now(),
+                                                      services.get_ms365_group())
         
+        # How LLM text is cut into TTS requests, the cached phrases are split the same way
+        proc.userdata["speech_chunker"] = SpeechChunker()
+
+        # Pre-rendered audio for the greeting and the filler phrases played while tools run
+        proc.userdata["phrase_cache"] = prepare_phrase_cache(
+            (GREETING, *FILLER_PHRASES, *TOOL_TIMING_PHRASES.values()),
+            lambda: openai.TTS(model=TTS_MODEL, voice=TTS_VOICE),
+            proc.userdata["speech_chunker"],
+        )
+
+        # Sentences synthesized before, in memory for this process and on disk for the host
+        proc.userdata["tts_cache"] = SynthesisCache()
+
         # Initialize VAD
         proc.userdata["vad"] = silero.VAD.load(min_speech_duration=0.2, min_silence_duration=0.5)
         
@@ -74,12 +94,19 @@ def prewarm(proc: JobProcess):
 
 #### PREWARM FUNCTION ####
 
-from instructions import INSTRUCTIONS
+from instructions import PIPELINE_INSTRUCTIONS, GREETING, FILLER_PHRASES, TOOL_TIMING_PHRASES
+
+
+async def chunked(text):
+    # say(str) synthesizes the whole text in one request, an async iterable goes through the agent's
+    # TTS stream and so is cut by the speech chunker into the chunks the phrase cache rendered
+    yield text
+
 
 async def entrypoint(ctx: JobContext):
     initial_ctx = llm.ChatContext().append(
     role="system",
-    text=INSTRUCTIONS)
+    text=PIPELINE_INSTRUCTIONS)
 
     def on_participant_disconnected(participant):
         logger.info(f"Participant disconnected: {participant.identity}")
@@ -90,10 +117,11 @@ async def entrypoint(ctx: JobContext):
     logger.info(f"Extracted phone number: {phone_number}")
 
     services = ctx.proc.userdata["services"]
-    fnc_ctx = ServiceDeskFunctionContext(updated_functions, 
+    fnc_ctx = ServiceDeskFunctionContext(ctx.proc.userdata["tool_registry"],
                                          phone_number,
-                                         services.get_service_now(),
-                                         services.get_ms365_group())
+                                         services.get_service_now())
+    # look the caller up in ServiceNow while we connect and greet
+    fnc_ctx.start_prefetch()
 
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
@@ -107,15 +135,42 @@ async def entrypoint(ctx: JobContext):
         vad=ctx.proc.userdata["vad"],
         stt=openai.STT(),
         llm=openai.LLM(model="gpt-4o"),
-        tts=openai.TTS(),
+        # LLM text goes to the TTS clause by clause (speech_chunker), each chunk is served from the
+        # pre-rendered phrases first, then sentences already synthesized on this host, then OpenAI
+        tts=tts.StreamAdapter(
+            tts=PhraseCacheTTS(CachingTTS(openai.TTS(model=TTS_MODEL, voice=TTS_VOICE), ctx.proc.userdata["tts_cache"]),
+                               ctx.proc.userdata["phrase_cache"]),
+            sentence_tokenizer=ctx.proc.userdata["speech_chunker"],
+        ),
         chat_ctx=initial_ctx,
         fnc_ctx=fnc_ctx,
+        # answers clearly recognised troubleshooting issues without the guide tool round-trip
+        before_llm_cb=fnc_ctx.before_llm_cb,
     )
 
+    # independent tool calls of one LLM turn run concurrently instead of one after another
+    assistant.on("function_calls_collected", fnc_ctx.on_function_calls_collected)
+    # a guide picked by the intent router is recorded once its reply has actually been spoken
+    assistant.on("agent_speech_committed", fnc_ctx.on_agent_speech_committed)
+    assistant.on("agent_speech_interrupted", fnc_ctx.on_agent_speech_interrupted)
+
+    # pre-rendered filler on its own track while a slow tool runs, instead of the LLM announcing it
+    filler = FillerPlayer(ctx.proc.userdata["phrase_cache"], ctx.proc.userdata["speech_chunker"],
+                          FILLER_PHRASES, TOOL_TIMING_PHRASES)
+    await filler.publish(ctx.room)
+    filler.attach(assistant)
+    fnc_ctx.on_slow_tool = filler.play
+
+    # per-turn waterfall (end of speech -> first audio) and process wide p50/p95/p99
+    latency = TurnLatencyRecorder(ctx.room.name)
+    latency.attach(assistant)
+    fnc_ctx.on_tool_timing = latency.on_tool_timing
+    ctx.add_shutdown_callback(latency.aclose)
+
     assistant.start(ctx.room, participant)
 
     # The agent should be polite and greet the user when it joins :)
-    await assistant.say("Hello, I'm FIONA, your IT support assistant. Before I can help you, please provide your employee ID for verification.", allow_interruptions=True)
+    await assistant.say(chunked(GREETING), allow_interruptions=True)
 
 
 
@@ -124,5 +179,7 @@ if __name__ == "__main__":
         WorkerOptions(
             entrypoint_fnc=entrypoint,
             prewarm_fnc=prewarm,
+            # prewarm fetches the Graph token, loads the directory and pre-renders phrases (each bounded)
+            initialize_process_timeout=float(os.getenv("WORKER_INITIALIZE_TIMEOUT", "20")),
         ),
     )
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+
+from livekit import rtc
+from livekit.agents import tts, utils
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Pre-rendered audio for the phrases the agent always says the same way (the greeting and the filler
+phrases from instructions.py), so they start playing without a TTS round-trip.
+
+In prewarm every sentence of those phrases is synthesized once with the configured voice and model
+and written to PHRASE_CACHE_DIR as raw 16 bit PCM (only sentences that are not on disk yet). The files
+are then memory-mapped read only, all worker processes on the host share the same pages.
+
+PhraseCacheTTS wraps the real TTS: synthesize(text) for a cached sentence streams the mapped audio,
+anything else goes to the wrapped TTS. The agent's stream adapter synthesizes chunk by chunk, so the
+phrases are split with the same tokenizer (speech_chunker.SpeechChunker) when they are rendered.
+A fixed phrase must therefore reach the agent as text to stream (say(async iterable), see main.chunked),
+say(str) synthesizes the whole string in one request and would miss the cache.
+
+File layout: magic (8s) | sample_rate (I) | num_channels (I) | PCM s16le
+'''
+
+MAGIC = b"PHRASE01"
+HEADER = struct.Struct("<8sII")
+FRAME_MS = 100
+
+TTS_MODEL = os.getenv("TTS_MODEL", "tts-1")
+TTS_VOICE = os.getenv("TTS_VOICE", "alloy")
+CACHE_DIR = Path(os.getenv("PHRASE_CACHE_DIR") or Path(__file__).parent / "phrase_cache")
+# seconds prewarm may spend rendering, what is not done by then is rendered by the next worker start
+PRERENDER_TIMEOUT = float(os.getenv("PHRASE_PRERENDER_TIMEOUT", "4"))
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def phrase_key(text, voice, model):
+    return hashlib.sha1(f"{model}\0{voice}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class PcmAudio:
+    """16 bit PCM held in `buffer` (bytes, or a mmap of an audio file) from `offset` on"""
+    def __init__(self, buffer, sample_rate, num_channels, offset=0):
+        self.buffer = buffer
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.offset = offset
+
+    @property
+    def nbytes(self):
+        return len(self.buffer) - self.offset
+
+    @classmethod
+    def parse(cls, buffer, source="buffer"):
+        magic, sample_rate, num_channels = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{source} is not a phrase audio file")
+        return cls(buffer, sample_rate, num_channels, HEADER.size)
+
+    def frames(self):
+        bytes_per_sample = 2 * self.num_channels
+        chunk = self.sample_rate * FRAME_MS // 1000 * bytes_per_sample
+        for start in range(self.offset, len(self.buffer), chunk):
+            data = self.buffer[start:start + chunk]
+            yield rtc.AudioFrame(
+                data=data,
+                sample_rate=self.sample_rate,
+                num_channels=self.num_channels,
+                samples_per_channel=len(data) // bytes_per_sample,
+            )
+
+
+def map_audio_file(path):
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PcmAudio.parse(mm, path)
+
+
+def write_audio_file(path, pcm, sample_rate, num_channels):
+    path = Path(path)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, sample_rate, num_channels))
+        f.write(pcm)
+    # atomic, another worker writing the same key just replaces it with identical audio
+    os.replace(tmp_path, path)
+
+
+class PhraseCache:
+    def __init__(self, voice=TTS_VOICE, model=TTS_MODEL, cache_dir=CACHE_DIR):
+        self.voice = voice
+        self.model = model
+        self.cache_dir = Path(cache_dir)
+        self._phrases = {}
+
+    def __len__(self):
+        return len(self._phrases)
+
+    def get(self, text):
+        return self._phrases.get(phrase_key(text, self.voice, self.model))
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.pcm"
+
+    def load(self, sentences):
+        for sentence in sentences:
+            key = phrase_key(sentence, self.voice, self.model)
+            if key in self._phrases or not self._path(key).exists():
+                continue
+            try:
+                self._phrases[key] = map_audio_file(self._path(key))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping cached phrase {key}: {str(e)}")
+
+    async def render(self, sentences, tts_factory):
+        """Synthesize the sentences that are not on disk yet, tts_factory() builds the TTS to use"""
+        missing = [sentence for sentence in sentences if not self._path(phrase_key(sentence, self.voice, self.model)).exists()]
+        if not missing:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        engine = tts_factory()
+        try:
+            results = await asyncio.gather(*(self._render_one(engine, sentence) for sentence in missing), return_exceptions=True)
+        finally:
+            await engine.aclose()
+        for sentence, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not pre-render phrase '{sentence}': {str(result)}")
+        logger.info(f"Pre-rendered {sum(not isinstance(result, Exception) for result in results)} phrases to {self.cache_dir}")
+
+    async def _render_one(self, engine, sentence):
+        pcm = bytearray()
+        sample_rate = num_channels = None
+        async for audio in engine.synthesize(sentence):
+            sample_rate, num_channels = audio.frame.sample_rate, audio.frame.num_channels
+            pcm += bytes(audio.frame.data)
+        if not pcm:
+            raise ValueError("TTS returned no audio")
+
+        write_audio_file(self._path(phrase_key(sentence, self.voice, self.model)), pcm, sample_rate, num_channels)
+
+
+def prepare_phrase_cache(phrases, tts_factory, sentence_tokenizer, voice=TTS_VOICE, model=TTS_MODEL):
+    """
+    Called from prewarm (no event loop running): render what is missing, then map every phrase sentence.
+    Rendering is bounded by PHRASE_PRERENDER_TIMEOUT, each sentence is written as soon as it is done,
+    so a cold cache fills up over a few worker starts. A sentence not rendered is synthesized live.
+    """
+    cache = PhraseCache(voice, model)
+    sentences = list(dict.fromkeys(
+        sentence for phrase in phrases for sentence in sentence_tokenizer.tokenize(phrase)
+    ))
+    try:
+        asyncio.get_running_loop()
+        logger.warning("Event loop already running, phrases not rendered in prewarm")
+    except RuntimeError:
+        try:
+            asyncio.run(asyncio.wait_for(cache.render(sentences, tts_factory), timeout=PRERENDER_TIMEOUT))
+        except asyncio.TimeoutError:
+            logger.warning(f"Phrase pre-rendering took over {PRERENDER_TIMEOUT}s, the rest is rendered on the next start")
+        except Exception as e:
+            logger.error(f"Phrase pre-rendering failed: {str(e)}")
+    cache.load(sentences)
+    logger.info(f"Phrase cache has {len(cache)} of {len(sentences)} sentences")
+    return cache
+
+
+class CachedChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts, input_text, audio):
+        super().__init__(tts=tts, input_text=input_text)
+        self._audio = audio
+
+    async def _main_task(self):
+        request_id = utils.shortuuid()
+        for frame in self._audio.frames():
+            self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+
+
+class PhraseCacheTTS(tts.TTS):
+    def __init__(self, wrapped, cache):
+        super().__init__(
+            capabilities=wrapped.capabilities,
+            sample_rate=wrapped.sample_rate,
+            num_channels=wrapped.num_channels,
+        )
+        self._wrapped = wrapped
+        self._cache = cache
+
+        # the agent listens on this TTS, pass on what the real one reports
+        @wrapped.on("metrics_collected")
+        def _forward_metrics(*args, **kwargs):
+            self.emit("metrics_collected", *args, **kwargs)
+
+    def synthesize(self, text):
+        audio = self._cache.get(text)
+        if audio is None:
+            return self._wrapped.synthesize(text)
+        return CachedChunkedStream(tts=self, input_text=text, audio=audio)
+
+    def stream(self):
+        return self._wrapped.stream()
+
+    async def aclose(self):
+        await self._wrapped.aclose()
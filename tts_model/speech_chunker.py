@@ -0,0 +1,123 @@
+import os
+import re
+
+from livekit.agents import tokenize, utils
+from livekit.agents.utils import aio
+
+
+'''
+Decides when LLM text is handed to the TTS in the pipeline agent (the sentence tokenizer of its
+tts.StreamAdapter). The default tokenizer waits for a whole sentence, so a long first sentence of a
+troubleshooting answer delays the first audio by that much generated text.
+
+    first chunk : cut at the first clause or sentence end once it has TTS_FIRST_CHUNK_MIN_CHARS,
+                  so audio starts after "Okay, let me walk you through it," instead of the paragraph
+    later       : cut at sentence ends once a chunk has TTS_CHUNK_MIN_CHARS, and at clause ends
+                  (, ; : dash) once it has TTS_CLAUSE_SPLIT_CHARS
+    any chunk   : never longer than TTS_CHUNK_MAX_CHARS, cut at the last space before it
+TTS_CHUNKING=sentence only cuts at sentence ends (and at TTS_CHUNK_MAX_CHARS).
+
+tokenize(text) gives the same chunks as streaming text, so the phrase cache and the filler player
+split their phrases exactly like the agent does when it says them.
+'''
+
+CHUNKING = os.getenv("TTS_CHUNKING", "clause").lower()
+FIRST_CHUNK_MIN_CHARS = int(os.getenv("TTS_FIRST_CHUNK_MIN_CHARS", "15"))
+CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "20"))
+CLAUSE_SPLIT_CHARS = int(os.getenv("TTS_CLAUSE_SPLIT_CHARS", "80"))
+CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "200"))
+
+# a boundary is only known once the whitespace after it has arrived ("3.5", "e.g" mid stream)
+_BOUNDARY = re.compile(
+    r"(?P<sentence>[.!?]+[\"')\]]*\s+|\n+\s*)"
+    r"|(?P<clause>[,;:]\s+|\s[-–—]\s+)"
+)
+
+
+class SpeechChunker(tokenize.SentenceTokenizer):
+    def __init__(self, clauses=CHUNKING != "sentence", first_min_chars=FIRST_CHUNK_MIN_CHARS,
+                 min_chars=CHUNK_MIN_CHARS, clause_split_chars=CLAUSE_SPLIT_CHARS, max_chars=CHUNK_MAX_CHARS):
+        self.clauses = clauses
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.clause_split_chars = clause_split_chars
+        self.max_chars = max_chars
+
+    def _next_cut(self, text, start, first):
+        min_chars = self.first_min_chars if first else self.min_chars
+        clause_chars = min_chars if first else self.clause_split_chars
+        for match in _BOUNDARY.finditer(text, start):
+            length = len(text[start:match.end()].strip())
+            if length > self.max_chars:
+                break
+            if match.group("sentence"):
+                if length >= min_chars:
+                    return match.end()
+            elif self.clauses and length >= clause_chars:
+                return match.end()
+        if len(text) - start > self.max_chars:
+            space = text.rfind(" ", start, start + self.max_chars)
+            return space + 1 if space > start else start + self.max_chars
+        return None
+
+    def split(self, text, first=True, final=False):
+        """(chunks, rest): the chunks ready in text, rest waits for more text unless final"""
+        chunks = []
+        start = 0
+        while (end := self._next_cut(text, start, first)) is not None:
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+                first = False
+            start = end
+        rest = text[start:]
+        if final:
+            if rest.strip():
+                chunks.append(rest.strip())
+            rest = ""
+        return chunks, rest
+
+    def tokenize(self, text, *, language=None):
+        return self.split(text, final=True)[0]
+
+    def stream(self, *, language=None):
+        return ChunkStream(self)
+
+
+class ChunkStream:
+    """Sentence stream the StreamAdapter reads from, one segment per flush"""
+    def __init__(self, chunker):
+        self._chunker = chunker
+        self._event_ch = aio.Chan()
+        self._reset()
+
+    def _reset(self):
+        self._buffer = ""
+        self._first = True
+        self._segment_id = utils.shortuuid()
+
+    def _send(self, chunks):
+        for chunk in chunks:
+            self._event_ch.send_nowait(tokenize.TokenData(segment_id=self._segment_id, token=chunk))
+        self._first = self._first and not chunks
+
+    def push_text(self, text):
+        chunks, self._buffer = self._chunker.split(self._buffer + text, self._first)
+        self._send(chunks)
+
+    def flush(self):
+        self._send(self._chunker.split(self._buffer, self._first, final=True)[0])
+        self._reset()
+
+    def end_input(self):
+        self.flush()
+        self._event_ch.close()
+
+    async def aclose(self):
+        self._event_ch.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._event_ch.__anext__()
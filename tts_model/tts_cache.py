@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from livekit.agents import tts, utils
+
+from phrase_cache import PcmAudio, CachedChunkedStream, normalize_text, phrase_key, write_audio_file, TTS_MODEL, TTS_VOICE
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Content addressed cache in front of the real TTS, for sentences the agent repeats word for word
+across calls ("Have you completed this step?", verification prompts, ticket confirmations).
+
+Key: sha1 of model, voice and the whitespace-normalized sentence (phrase_cache.phrase_key).
+    memory : LRU of PCM, bounded by TTS_CACHE_MEMORY_MB, per worker process (SynthesisCache in prewarm)
+    disk   : one phrase audio file per key in TTS_CACHE_DIR, shared by the workers on the host. A key
+             missing from this process's index is still looked for on disk (another worker may have
+             written it), and the index is rebuilt from the directory at most every
+             TTS_CACHE_RESCAN_SECONDS when storing, so TTS_CACHE_DISK_MB bounds the files of all
+             workers (least recently used are deleted), give or take that interval
+A miss streams the real synthesis through unchanged while recording it, then stores it in both tiers.
+Sentences longer than TTS_CACHE_MAX_CHARS are not cached, they hardly ever repeat.
+'''
+
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR") or Path(__file__).parent / "tts_cache")
+MEMORY_BYTES = int(float(os.getenv("TTS_CACHE_MEMORY_MB", "32")) * 1024 * 1024)
+DISK_BYTES = int(float(os.getenv("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024)
+MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", "200"))
+RESCAN_SECONDS = float(os.getenv("TTS_CACHE_RESCAN_SECONDS", "60"))
+
+
+class SynthesisCache:
+    """The two cache tiers, one per worker process (created in prewarm, not bound to an event loop)"""
+    def __init__(self, voice=TTS_VOICE, model=TTS_MODEL, cache_dir=CACHE_DIR,
+                 memory_bytes=MEMORY_BYTES, disk_bytes=DISK_BYTES, max_chars=MAX_CHARS):
+        self.voice = voice
+        self.model = model
+        self.cache_dir = Path(cache_dir)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_chars = max_chars
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()   # key -> PcmAudio, least recently used first
+        self._memory_size = 0
+        self._disk = OrderedDict()     # key -> file size, least recently used first
+        self._disk_size = 0
+        self._scanned_at = 0.0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._set_disk_index(self._scan_files())
+        logger.info(f"TTS cache has {len(self._disk)} sentences on disk ({self._disk_size // 1024} KiB)")
+
+    def _scan_files(self):
+        """(mtime, key, size) of every cache file, oldest first, from every worker"""
+        files = []
+        for path in self.cache_dir.glob("*.pcm"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        return sorted(files)
+
+    def _set_disk_index(self, files):
+        self._disk = OrderedDict((key, size) for _, key, size in files)
+        self._disk_size = sum(self._disk.values())
+        self._scanned_at = time.monotonic()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.pcm"
+
+    def key(self, text):
+        """Cache key for text, None when it is too long to be worth caching"""
+        if len(normalize_text(text)) > self.max_chars:
+            return None
+        return phrase_key(text, self.voice, self.model)
+
+    def get_memory(self, key):
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+        return audio
+
+    def _remember(self, key, audio):
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key).nbytes
+        self._memory[key] = audio
+        self._memory_size += audio.nbytes
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= evicted.nbytes
+
+    def _read_file(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)   # keeps recently used files last when another worker rebuilds its index
+        except OSError:
+            return None
+        return PcmAudio.parse(data, path)
+
+    def _delete_files(self, keys):
+        for key in keys:
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    async def load(self, key):
+        """Audio for key from memory or disk, None on a miss"""
+        audio = self.get_memory(key)
+        if audio is not None:
+            return audio
+        try:
+            # file IO in a thread, the index itself is only touched on the event loop. Keys missing
+            # from the index are read too, another worker may have written them since our last scan
+            audio = await asyncio.to_thread(self._read_file, key)
+        except ValueError as e:
+            logger.warning(f"Dropping unreadable TTS cache entry {key}: {str(e)}")
+            audio = None
+        if audio is None:
+            self._disk_size -= self._disk.pop(key, 0)
+            return None
+        self._disk_size += audio.nbytes - self._disk.pop(key, 0)
+        self._disk[key] = audio.nbytes
+        self._remember(key, audio)
+        return audio
+
+    async def store(self, key, pcm, sample_rate, num_channels):
+        pcm = bytes(pcm)
+        self._remember(key, PcmAudio(pcm, sample_rate, num_channels))
+        try:
+            await asyncio.to_thread(write_audio_file, self._path(key), pcm, sample_rate, num_channels)
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache entry {key}: {str(e)}")
+            return
+
+        if time.monotonic() - self._scanned_at > RESCAN_SECONDS:
+            # pick up the other workers' files so the bound covers the whole directory
+            self._set_disk_index(await asyncio.to_thread(self._scan_files))
+        self._disk_size += len(pcm) - self._disk.pop(key, 0)
+        self._disk[key] = len(pcm)
+        evicted = []
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            old_key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            evicted.append(old_key)
+        if evicted:
+            await asyncio.to_thread(self._delete_files, evicted)
+
+
+class CachingTTS(tts.TTS):
+    def __init__(self, wrapped, cache):
+        super().__init__(
+            capabilities=wrapped.capabilities,
+            sample_rate=wrapped.sample_rate,
+            num_channels=wrapped.num_channels,
+        )
+        # metrics of misses are reported by the CachingChunkedStream wrapping the real synthesis,
+        # so the wrapped TTS's own metrics are not forwarded (they would be counted twice)
+        self._wrapped = wrapped
+        self._cache = cache
+
+    def synthesize(self, text):
+        key = self._cache.key(text)
+        if key is None:
+            return self._wrapped.synthesize(text)
+        audio = self._cache.get_memory(key)
+        if audio is not None:
+            self._cache.hits += 1
+            return CachedChunkedStream(tts=self, input_text=text, audio=audio)
+        return CachingChunkedStream(tts=self, input_text=text, key=key)
+
+    def stream(self):
+        return self._wrapped.stream()
+
+    async def aclose(self):
+        await self._wrapped.aclose()
+
+
+class CachingChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts, input_text, key):
+        super().__init__(tts=tts, input_text=input_text)
+        self._wrapped = tts._wrapped
+        self._cache = tts._cache
+        self._key = key
+
+    async def _main_task(self):
+        audio = await self._cache.load(self._key)
+        if audio is not None:
+            self._cache.hits += 1
+            request_id = utils.shortuuid()
+            for frame in audio.frames():
+                self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+            return
+
+        self._cache.misses += 1
+        pcm = bytearray()
+        sample_rate = num_channels = None
+        inner = self._wrapped.synthesize(self._input_text)
+        try:
+            async for audio in inner:
+                sample_rate, num_channels = audio.frame.sample_rate, audio.frame.num_channels
+                pcm += bytes(audio.frame.data)
+                self._event_ch.send_nowait(audio)
+        finally:
+            await inner.aclose()
+
+        if pcm:
+            await self._cache.store(self._key, pcm, sample_rate, num_channels)
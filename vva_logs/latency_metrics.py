@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Per-turn latency recorder for the TTS pipeline and the realtime (S2S) agent.
+
+A turn starts when the caller stops speaking (user_stopped_speaking). Offsets are recorded in ms from
+that point, taken from the agent events and its metrics_collected payloads:
+    stt_final        - final transcript (pipeline EOU metrics, else user_speech_committed)
+    end_of_utterance - the agent decided the caller finished (pipeline EOU metrics)
+    llm_first_token  - LLM metrics, request start + ttft
+    tool:<name>      - start and end of every tool call (ServiceDeskFunctionContext.on_tool_timing)
+    tts_first_byte   - TTS metrics, request start + ttfb
+    first_audio      - first agent audio published (agent_started_speaking)
+
+Every finished turn is logged as a waterfall and appended to LATENCY_LOG_DIR/latency_turns.jsonl.
+The offsets also feed process wide histograms, logged as p50/p95/p99 when a call ends.
+'''
+
+LOG_DIR = Path(os.getenv("LATENCY_LOG_DIR") or Path(__file__).parent)
+HISTOGRAM_SIZE = int(os.getenv("LATENCY_HISTOGRAM_SIZE", "2000"))
+
+# stage -> recent latencies in ms, shared by every call in the worker process
+_histograms = defaultdict(lambda: deque(maxlen=HISTOGRAM_SIZE))
+
+
+def percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def latency_summary():
+    """stage -> {"count", "p50", "p95", "p99"} in ms over the recent turns of this process"""
+    summary = {}
+    for stage, values in _histograms.items():
+        ordered = sorted(values)
+        if ordered:
+            summary[stage] = {
+                "count": len(ordered),
+                "p50": round(percentile(ordered, 0.50)),
+                "p95": round(percentile(ordered, 0.95)),
+                "p99": round(percentile(ordered, 0.99)),
+            }
+    return summary
+
+
+class Turn:
+    def __init__(self, number, started_at):
+        self.number = number
+        self.started_at = started_at
+        self.marks = {}    # label -> ms after started_at
+        self.tools = []    # {"name", "start_ms", "end_ms"}
+
+    def offset(self, at):
+        return round((at - self.started_at) * 1000)
+
+    def mark(self, label, at):
+        # the first occurrence wins, later LLM / TTS requests of the same turn are not its latency
+        self.marks.setdefault(label, self.offset(at))
+
+    def waterfall(self):
+        rows = [(ms, f"{label} +{ms}ms") for label, ms in self.marks.items()]
+        rows += [(tool["start_ms"], f"{tool['name']} +{tool['start_ms']}..{tool['end_ms']}ms") for tool in self.tools]
+        return " | ".join(row for _, row in sorted(rows))
+
+    def as_dict(self):
+        return {"turn": self.number, "started_at": self.started_at, "marks": self.marks, "tools": self.tools}
+
+
+class TurnLatencyRecorder:
+    def __init__(self, call_id):
+        self.call_id = call_id
+        self.turns = []
+        self._turn = None
+
+    def attach(self, agent):
+        """Subscribe to a VoicePipelineAgent or MultimodalAgent"""
+        @agent.on("user_stopped_speaking")
+        def _user_stopped():
+            self._start_turn()
+
+        @agent.on("user_speech_committed")
+        def _user_committed(*args):
+            self._mark("stt_final", time.time())
+
+        @agent.on("agent_started_speaking")
+        def _agent_started():
+            self._mark("first_audio", time.time())
+
+        @agent.on("metrics_collected")
+        def _metrics(metrics):
+            self.on_metrics(metrics)
+
+    def _start_turn(self):
+        self._finish_turn()
+        self._turn = Turn(len(self.turns) + 1, time.time())
+
+    def _mark(self, label, at):
+        if self._turn is not None:
+            self._turn.mark(label, at)
+
+    def on_metrics(self, metrics):
+        # duck typed over the livekit metrics dataclasses: timestamp is when the request finished
+        if self._turn is None:
+            return
+        timestamp = getattr(metrics, "timestamp", None) or time.time()
+        if hasattr(metrics, "end_of_utterance_delay"):
+            # EOU delays are measured from the end of speech, which is where the turn started
+            self._turn.marks.setdefault("stt_final", round(metrics.transcription_delay * 1000))
+            self._turn.marks.setdefault("end_of_utterance", round(metrics.end_of_utterance_delay * 1000))
+        elif hasattr(metrics, "ttft"):
+            if metrics.ttft is not None and metrics.ttft >= 0:
+                self._mark("llm_first_token", timestamp - metrics.duration + metrics.ttft)
+        elif hasattr(metrics, "ttfb"):
+            if metrics.ttfb is not None and metrics.ttfb >= 0:
+                self._mark("tts_first_byte", timestamp - metrics.duration + metrics.ttfb)
+
+    def on_tool_timing(self, name, started_at, finished_at):
+        """ServiceDeskFunctionContext.on_tool_timing callback, wall clock seconds"""
+        if self._turn is not None:
+            self._turn.tools.append({
+                "name": name,
+                "start_ms": self._turn.offset(started_at),
+                "end_ms": self._turn.offset(finished_at),
+            })
+
+    def _finish_turn(self):
+        turn, self._turn = self._turn, None
+        if turn is None or "first_audio" not in turn.marks:
+            return  # the caller spoke again before the agent answered, nothing to measure
+        self.turns.append(turn)
+        for label, ms in turn.marks.items():
+            _histograms[label].append(ms)
+        for tool in turn.tools:
+            _histograms[f"tool:{tool['name']}"].append(tool["end_ms"] - tool["start_ms"])
+        logger.info(f"[{self.call_id}] turn {turn.number}: {turn.waterfall()}")
+
+    def _write(self):
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        with open(LOG_DIR / "latency_turns.jsonl", "a", encoding="utf-8") as f:
+            for turn in self.turns:
+                f.write(json.dumps({"call": self.call_id, **turn.as_dict()}) + "\n")
+
+    async def aclose(self):
+        """Call end: close the last turn, write the call's waterfalls and log the process percentiles"""
+        self._finish_turn()
+        if self.turns:
+            await asyncio.to_thread(self._write)
+        for stage, stats in sorted(latency_summary().items()):
+            logger.info(f"latency {stage}: p50 {stats['p50']}ms p95 {stats['p95']}ms p99 {stats['p99']}ms (n={stats['count']})")